@@ -0,0 +1,130 @@
+"""Compare the benchmark results of two revisions of xml_helpers.
+
+The revisions are checked out to temporary git worktrees, and the
+benchmarks of the current tree are run against each of them on the same
+datasets. Without --head, the current working tree is compared with the
+base revision.
+
+Usage::
+
+    python3 benchmarks/compare_benchmarks.py --base v0.20 --size medium
+
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import generate
+import run_benchmarks
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+
+def run_revision(revision, output, arguments):
+    """Run the benchmarks against a revision.
+
+    :revision: Git revision, or None for the current working tree
+    :output: Path of the JSON result file
+    :arguments: Arguments passed to run_benchmarks
+    """
+    worktree = None
+    package_dir = REPOSITORY_DIR
+    if revision is not None:
+        worktree = tempfile.mkdtemp(prefix='xml-helpers-benchmark-')
+        subprocess.run(['git', 'worktree', 'add', '--detach', worktree,
+                        revision], cwd=REPOSITORY_DIR, check=True)
+        package_dir = worktree
+    try:
+        print(f'# {revision or "working tree"}', flush=True)
+        subprocess.run(
+            [sys.executable, os.path.join(BENCHMARKS_DIR, 'run_benchmarks.py'),
+             '--output', output] + arguments,
+            env=dict(os.environ, PYTHONPATH=package_dir), check=True)
+    finally:
+        if worktree is not None:
+            subprocess.run(['git', 'worktree', 'remove', '--force', worktree],
+                           cwd=REPOSITORY_DIR, check=False)
+            shutil.rmtree(worktree, ignore_errors=True)
+
+
+def compare(base_results, head_results):
+    """Format the comparison of two result files.
+
+    :base_results: Results of the base revision, see run_benchmarks
+    :head_results: Results of the compared revision
+    :returns: List of the lines of the comparison table
+    """
+    base = {(result['benchmark'], result['dataset'], result['size']): result
+            for result in base_results['results']}
+    lines = [f"{'benchmark':<44} {'base p50':>10} {'head p50':>10} "
+             f"{'change':>8} {'base RSS':>10} {'head RSS':>10}"]
+    for result in head_results['results']:
+        key = (result['benchmark'], result['dataset'], result['size'])
+        label = f'{key[0]} {key[1]}-{key[2]}'
+        base_result = base.get(key)
+        if base_result is None or 'error' in base_result or \
+                'error' in result:
+            error = (base_result or {}).get('error') or result.get('error')
+            lines.append(f'{label:<44} not comparable: {error}')
+            continue
+        base_time = base_result['latency']['p50']
+        head_time = result['latency']['p50']
+        change = (head_time - base_time) / base_time * 100
+        lines.append(
+            f'{label:<44} {base_time:9.4f}s {head_time:9.4f}s '
+            f'{change:+7.1f}% '
+            f"{base_result['peak_rss_kib'] / 1024:7.1f}MiB "
+            f"{result['peak_rss_kib'] / 1024:7.1f}MiB")
+    return lines
+
+
+def main(arguments=None):
+    """Parse the arguments, run the benchmarks of both revisions and print
+    the comparison.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--base', default='HEAD',
+                        help='Base revision, defaults to HEAD')
+    parser.add_argument('--head',
+                        help='Compared revision, defaults to the working '
+                             'tree')
+    parser.add_argument('--size', nargs='+', default=['small'],
+                        choices=list(generate.SIZES))
+    parser.add_argument('--benchmark', nargs='+',
+                        choices=list(run_benchmarks.BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--data-dir',
+                        default=os.path.join(REPOSITORY_DIR,
+                                             run_benchmarks.DEFAULT_DATA_DIR))
+    parser.add_argument('--output-dir',
+                        default=os.path.join(REPOSITORY_DIR, '.benchmark'),
+                        help='Directory of the JSON result files')
+    args = parser.parse_args(arguments)
+
+    benchmark_arguments = ['--size'] + args.size + [
+        '--repeat', str(args.repeat), '--data-dir', args.data_dir]
+    if args.benchmark:
+        benchmark_arguments += ['--benchmark'] + args.benchmark
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    base_output = os.path.join(args.output_dir, 'base.json')
+    head_output = os.path.join(args.output_dir, 'head.json')
+    run_revision(args.base, base_output, benchmark_arguments)
+    run_revision(args.head, head_output, benchmark_arguments)
+
+    with open(base_output, encoding='utf-8') as base_file, \
+            open(head_output, encoding='utf-8') as head_file:
+        lines = compare(json.load(base_file), json.load(head_file))
+    print(f'# {args.base} -> {args.head or "working tree"}')
+    print('\n'.join(lines))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
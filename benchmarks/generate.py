@@ -0,0 +1,181 @@
+"""Generators of synthetic XML documents and catalog chains for the
+benchmarks.
+
+The documents are written in chunks, so that even the multi-GB documents
+are generated with constant memory. The generators do not use xml_helpers,
+so that the same data can be used for benchmarking any revision.
+"""
+
+import os
+
+# Approximate sizes of the generated documents in bytes
+SIZES = {
+    'small': 100 * 1024,
+    'medium': 10 * 1024 * 1024,
+    'large': 200 * 1024 * 1024,
+    'huge': 2 * 1024 * 1024 * 1024,
+}
+
+# Number of rewrite rules in each catalog file of a catalog chain, and the
+# number of catalog files in the chain for each size
+CATALOG_RULES = 100
+CATALOG_FILES = {
+    'small': 5,
+    'medium': 100,
+    'large': 1000,
+    'huge': 5000,
+}
+
+# Depth of the element chains in the deep documents, kept below the depth
+# limit of libxml2 without huge_tree
+DEEP_DEPTH = 200
+
+# Number of namespaces used in the namespace heavy documents
+NAMESPACES = 20
+
+WRITE_BUFFER = 1024 * 1024
+
+
+def _write_document(path, size, start, chunks, end):
+    """Write a document of approximately the given size.
+
+    :path: Path of the document
+    :size: Approximate size of the document in bytes
+    :start: Beginning of the document as string
+    :chunks: Function returning the n:th repeated chunk as string
+    :end: End of the document as string
+    """
+    written = 0
+    index = 0
+    with open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER) as out:
+        out.write(start)
+        while written < size:
+            chunk = chunks(index)
+            out.write(chunk)
+            written += len(chunk)
+            index += 1
+        out.write(end)
+
+
+def wide_document(path, size):
+    """Write a document with a large number of small sibling records.
+
+    :path: Path of the document
+    :size: Approximate size of the document in bytes
+    """
+    _write_document(
+        path, size,
+        '<?xml version="1.0" encoding="UTF-8"?>\n<records>\n',
+        lambda index: (
+            f'  <record ID="id{index}" type="item">\n'
+            f'    <title>Record number {index}</title>\n'
+            f'    <value unit="bytes">{index * 7}</value>\n'
+            f'    <note>Text with ä &amp; ö in record {index}</note>\n'
+            f'  </record>\n'),
+        '</records>\n')
+
+
+def deep_document(path, size):
+    """Write a document of deeply nested element chains.
+
+    :path: Path of the document
+    :size: Approximate size of the document in bytes
+    """
+    def chain(index):
+        return ''.join(
+            f'<level depth="{depth}">' for depth in range(DEEP_DEPTH)
+        ) + f'chain {index}' + '</level>' * DEEP_DEPTH + '\n'
+
+    _write_document(
+        path, size,
+        '<?xml version="1.0" encoding="UTF-8"?>\n<chains>\n', chain,
+        '</chains>\n')
+
+
+def namespace_document(path, size):
+    """Write a document of records using many namespaces for elements and
+    attributes.
+
+    :path: Path of the document
+    :size: Approximate size of the document in bytes
+    """
+    declarations = ' '.join(
+        f'xmlns:ns{index}="http://localhost.test/ns/{index}"'
+        for index in range(NAMESPACES))
+
+    def record(index):
+        prefix = f'ns{index % NAMESPACES}'
+        other = f'ns{(index + 1) % NAMESPACES}'
+        return (
+            f'  <{prefix}:record {other}:ID="id{index}" '
+            f'xmlns:local="http://localhost.test/local/{index % 100}">\n'
+            f'    <{other}:title local:lang="fi">Record {index}'
+            f'</{other}:title>\n'
+            f'    <local:value {prefix}:unit="bytes">{index * 7}'
+            f'</local:value>\n'
+            f'  </{prefix}:record>\n')
+
+    _write_document(
+        path, size,
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<ns0:records {declarations}>\n', record,
+        '</ns0:records>\n')
+
+
+def catalog_chain(directory, files):
+    """Write a chain of catalog files linked with nextCatalog entries.
+
+    :directory: Directory of the catalog files, the first catalog file is
+                catalog_0.xml
+    :files: Number of catalog files in the chain
+    """
+    os.makedirs(directory, exist_ok=True)
+    # The first catalog file is written last, so that an interrupted chain
+    # is regenerated
+    for index in reversed(range(files)):
+        rules = ''.join(
+            f'  <rewriteURI uriStartString="http://localhost.test/'
+            f'{index}/{rule}/" rewritePrefix="schemas/{index}/{rule}/"/>\n'
+            for rule in range(CATALOG_RULES))
+        next_catalog = ''
+        if index + 1 < files:
+            next_catalog = (
+                f'  <nextCatalog catalog="catalog_{index + 1}.xml"/>\n')
+        with open(os.path.join(directory, f'catalog_{index}.xml'), 'w',
+                  encoding='utf-8') as out:
+            out.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<catalog xmlns="urn:oasis:names:tc:entity:xmlns:xml:catalog" '
+                'prefer="public">\n' + rules + next_catalog + '</catalog>\n')
+
+
+DOCUMENTS = {
+    'wide': wide_document,
+    'deep': deep_document,
+    'namespaces': namespace_document,
+}
+
+
+def dataset(data_dir, kind, size_name):
+    """Return the path of a dataset, generating it if it does not exist
+    yet.
+
+    :data_dir: Directory of the generated datasets
+    :kind: 'wide', 'deep', 'namespaces' or 'catalog'
+    :size_name: Name of the size in SIZES
+    :returns: Path of the document, or of the first catalog file
+    """
+    if kind == 'catalog':
+        directory = os.path.join(data_dir, f'catalog-{size_name}')
+        path = os.path.join(directory, 'catalog_0.xml')
+        if not os.path.exists(path):
+            catalog_chain(directory, CATALOG_FILES[size_name])
+        return path
+
+    path = os.path.join(data_dir, f'{kind}-{size_name}.xml')
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        partial_path = path + '.partial'
+        DOCUMENTS[kind](partial_path, SIZES[size_name])
+        os.replace(partial_path, path)
+    return path
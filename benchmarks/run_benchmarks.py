@@ -0,0 +1,263 @@
+"""Run the benchmarks of xml_helpers.
+
+Every benchmark is run on synthetic datasets generated by the generate
+module. Each combination of a benchmark and a dataset is run in a fresh
+process, so that the peak RSS is measured for that benchmark only. The
+xml_helpers package is imported from PYTHONPATH, so that any revision of
+it can be benchmarked with the same benchmarks.
+
+Usage::
+
+    PYTHONPATH=. python3 benchmarks/run_benchmarks.py --size small medium \\
+        --output results.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from resource import RUSAGE_SELF, getrusage
+
+import generate
+
+# Benchmarks that load whole trees are not run on datasets larger than
+# these, as the trees would not fit in memory
+TREE_SIZES = ('small', 'medium', 'large')
+
+DEFAULT_DATA_DIR = '.benchmark/data'
+
+
+def _element_count(path):
+    """Count the elements in a document without loading it.
+
+    :path: Path of the document
+    :returns: Number of elements
+    """
+    import lxml.etree as ET  # pylint: disable=import-outside-toplevel
+    count = 0
+    for _, element in ET.iterparse(path, huge_tree=True):
+        count += 1
+        element.clear(keep_tail=True)
+    return count
+
+
+def _timed(function, repeat):
+    """Call a function repeatedly and measure the wall time of each call.
+
+    :function: Function without arguments
+    :repeat: Number of calls
+    :returns: Tuple of the list of call durations in seconds and the
+              return value of the last call
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return durations, result
+
+
+def bench_readfile(path, repeat):
+    """Benchmark reading whole documents with readfile."""
+    # pylint: disable=import-outside-toplevel
+    from xml_helpers.utils import readfile
+    durations, _ = _timed(lambda: readfile(path), repeat)
+    return durations, os.path.getsize(path), _element_count(path)
+
+
+def bench_serialize(path, repeat):
+    """Benchmark serializing whole trees with serialize."""
+    # pylint: disable=import-outside-toplevel
+    from xml_helpers.utils import readfile, serialize
+    root = readfile(path).getroot()
+    durations, result = _timed(lambda: serialize(root), repeat)
+    return durations, len(result), _element_count(path)
+
+
+def bench_iter_elements(path, repeat):
+    """Benchmark streaming all elements of documents with iter_elements."""
+    # pylint: disable=import-outside-toplevel
+    from xml_helpers.utils import iter_elements
+
+    def iterate():
+        count = 0
+        with open(path, 'rb') as in_file:
+            for _ in iter_elements(in_file):
+                count += 1
+        return count
+
+    durations, count = _timed(iterate, repeat)
+    return durations, os.path.getsize(path), count
+
+
+def bench_compare_trees(path, repeat):
+    """Benchmark comparing two identical whole trees with compare_trees."""
+    # pylint: disable=import-outside-toplevel
+    from xml_helpers.utils import compare_trees, readfile
+    root1 = readfile(path).getroot()
+    root2 = readfile(path).getroot()
+    durations, _ = _timed(lambda: compare_trees(root1, root2), repeat)
+    return durations, 2 * os.path.getsize(path), 2 * _element_count(path)
+
+
+def bench_parse_catalog_schema_uris(path, repeat):
+    """Benchmark reading catalog chains with parse_catalog_schema_uris.
+    The catalog cache, if any, is cleared before each call.
+    """
+    # pylint: disable=import-outside-toplevel
+    from xml_helpers import schema_catalog
+    cache = getattr(schema_catalog, 'CATALOG_CACHE', None)
+    base_path, catalog_relpath = os.path.split(path)
+
+    def parse():
+        if cache is not None:
+            cache.clear()
+        return schema_catalog.parse_catalog_schema_uris(base_path,
+                                                        catalog_relpath)
+
+    durations, result = _timed(parse, repeat)
+    size = sum(os.path.getsize(os.path.join(base_path, name))
+               for name in os.listdir(base_path))
+    return durations, size, len(result)
+
+
+# Benchmark functions, the dataset kinds they are run on, and the sizes
+# they are limited to
+BENCHMARKS = {
+    'readfile': (bench_readfile, ('wide', 'deep', 'namespaces'),
+                 TREE_SIZES),
+    'serialize': (bench_serialize, ('wide', 'deep', 'namespaces'),
+                  TREE_SIZES),
+    'iter_elements': (bench_iter_elements, ('wide', 'deep', 'namespaces'),
+                      tuple(generate.SIZES)),
+    'compare_trees': (bench_compare_trees, ('wide', 'deep', 'namespaces'),
+                      TREE_SIZES),
+    'parse_catalog_schema_uris': (bench_parse_catalog_schema_uris,
+                                  ('catalog',), tuple(generate.SIZES)),
+}
+
+
+def percentile(values, percent):
+    """Return the nearest-rank percentile of values.
+
+    :values: Sorted list of values
+    :percent: Percentile between 0 and 100
+    :returns: Value at the percentile
+    """
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+
+def run_single(name, kind, size_name, data_dir, repeat):
+    """Run one benchmark on one dataset in this process.
+
+    :returns: Result as a dict
+    """
+    path = generate.dataset(data_dir, kind, size_name)
+    durations, size, elements = BENCHMARKS[name][0](path, repeat)
+    durations.sort()
+    median = percentile(durations, 50)
+    return {
+        'latency': {
+            'min': durations[0],
+            'p50': median,
+            'p90': percentile(durations, 90),
+            'p99': percentile(durations, 99),
+            'max': durations[-1],
+        },
+        'bytes': size,
+        'elements': elements,
+        'mb_per_s': size / median / 1e6 if median else None,
+        'elements_per_s': elements / median if median else None,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_kib': getrusage(RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_in_subprocess(name, kind, size_name, data_dir, repeat):
+    """Run one benchmark on one dataset in a fresh process.
+
+    :returns: Result as a dict, with the error message if the benchmark
+              failed
+    """
+    result = {'benchmark': name, 'dataset': kind, 'size': size_name}
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--single', name, kind,
+         size_name, '--data-dir', data_dir, '--repeat', str(repeat)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if process.returncode != 0:
+        lines = process.stderr.decode('utf-8', 'replace').strip().splitlines()
+        result['error'] = lines[-1] if lines else \
+            f'Exited with status {process.returncode}'
+    else:
+        result.update(json.loads(process.stdout))
+    return result
+
+
+def _format_result(result):
+    """Format a result as a line of the summary table."""
+    label = f"{result['benchmark']} {result['dataset']}-{result['size']}"
+    if 'error' in result:
+        return f"{label:<44} ERROR {result['error']}"
+    latency = result['latency']
+    return (f"{label:<44} p50 {latency['p50']:9.4f} s  "
+            f"p90 {latency['p90']:9.4f} s  "
+            f"{result['mb_per_s']:8.1f} MB/s  "
+            f"{result['peak_rss_kib'] / 1024:8.1f} MiB")
+
+
+def main(arguments=None):
+    """Parse the arguments and run the benchmarks."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', nargs='+', default=['small'],
+                        choices=list(generate.SIZES),
+                        help='Sizes of the datasets')
+    parser.add_argument('--benchmark', nargs='+', choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS),
+                        help='Benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of timed calls in each benchmark')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='Directory of the generated datasets')
+    parser.add_argument('--output', help='Write the results to JSON file')
+    parser.add_argument('--single', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(arguments)
+
+    if args.single:
+        json.dump(run_single(*args.single, args.data_dir, args.repeat),
+                  sys.stdout)
+        return 0
+
+    import xml_helpers  # pylint: disable=import-outside-toplevel
+    results = []
+    for name in args.benchmark:
+        _, kinds, sizes = BENCHMARKS[name]
+        for size_name in args.size:
+            if size_name not in sizes:
+                continue
+            for kind in kinds:
+                generate.dataset(args.data_dir, kind, size_name)
+                result = run_in_subprocess(name, kind, size_name,
+                                           args.data_dir, args.repeat)
+                print(_format_result(result), flush=True)
+                results.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            json.dump({
+                'xml_helpers': os.path.dirname(
+                    os.path.abspath(xml_helpers.__file__)),
+                'python': platform.python_version(),
+                'repeat': args.repeat,
+                'results': results,
+            }, out, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
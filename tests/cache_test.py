@@ -0,0 +1,39 @@
+"""Test cache-module."""
+from xml_helpers.cache import LRUCache
+
+
+def test_lru_cache_eviction():
+    """Test that the least recently used value is evicted first and the
+    counters are updated.
+    """
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+    info = cache.info()
+    assert (info.hits, info.misses, info.evictions) == (2, 1, 1)
+    assert (info.maxsize, info.currsize) == (2, 2)
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.info().hits == 0
+
+
+def test_lru_cache_weigher():
+    """Test that the cache size is limited by the weights of the values."""
+    cache = LRUCache(maxsize=10, weigher=len)
+    cache.put('a', b'12345')
+    cache.put('b', b'123456')
+    assert 'a' not in cache
+    assert cache.info().currsize == 6
+
+    # Values heavier than the whole cache are not cached
+    cache.put('c', b'12345678901')
+    assert 'c' not in cache
+    assert 'b' in cache
@@ -0,0 +1,171 @@
+"""Test instrumentation-module."""
+from io import BytesIO
+
+import pytest
+
+import lxml.etree as ET
+
+from xml_helpers import instrumentation
+from xml_helpers.schema_catalog import (construct_catalog_xml,
+                                        flatten_catalog,
+                                        parse_catalog_schema_uris)
+from xml_helpers.utils import (compare_trees, iter_elements, readfile,
+                               serialize)
+
+XML = b'<root><a>1</a><b><c/></b></root>'
+
+
+@pytest.fixture
+def instrumentation_enabled():
+    """Enable the instrumentation with empty statistics for a test."""
+    enabled = instrumentation.is_enabled()
+    instrumentation.reset()
+    instrumentation.enable()
+    yield
+    if not enabled:
+        instrumentation.disable()
+    instrumentation.reset()
+
+
+def test_disabled():
+    """Test that nothing is recorded when the instrumentation is disabled."""
+    enabled = instrumentation.is_enabled()
+    instrumentation.disable()
+    instrumentation.reset()
+    try:
+        readfile(XML)
+        assert instrumentation.snapshot() == {}
+    finally:
+        if enabled:
+            instrumentation.enable()
+
+
+# pylint: disable=redefined-outer-name,unused-argument
+def test_snapshot(instrumentation_enabled):
+    """Test that the calls, bytes and elements of the instrumented functions
+    are recorded.
+    """
+    tree = readfile(XML)
+    readfile(BytesIO(XML))
+    serialized = serialize(tree.getroot())
+    assert len(list(iter_elements(BytesIO(XML)))) == 4
+    construct_catalog_xml(rewrite_rules={'a': 'b'})
+
+    stats = instrumentation.snapshot()
+    assert stats['readfile'].calls == 2
+    assert stats['readfile'].bytes == 2 * len(XML)
+    assert stats['readfile'].elements == 8
+    assert stats['readfile'].seconds > 0
+    assert stats['serialize'][1:] == (stats['serialize'].seconds,
+                                      len(serialized), 4)
+    assert stats['iter_elements'].calls == 1
+    assert (stats['iter_elements'].bytes,
+            stats['iter_elements'].elements) == (len(XML), 4)
+    assert stats['construct_catalog_xml'].elements == 2
+
+    instrumentation.reset()
+    assert instrumentation.snapshot() == {}
+
+
+def test_failed_call(instrumentation_enabled):
+    """Test that failed calls are recorded without bytes and elements."""
+    with pytest.raises(Exception):
+        readfile(b'<root>')
+    assert instrumentation.snapshot()['readfile'][::2] == (1, 0)
+
+
+def test_callbacks(instrumentation_enabled):
+    """Test that the callbacks are called after each call, and that failing
+    callbacks only cause warnings.
+    """
+    calls = []
+
+    def callback(name, seconds, size, elements):
+        calls.append((name, size, elements))
+
+    def failing_callback(*args):
+        raise RuntimeError('metrics system is down')
+
+    instrumentation.add_callback(callback)
+    instrumentation.add_callback(failing_callback)
+    try:
+        with pytest.warns(UserWarning, match='metrics system is down'):
+            readfile(XML)
+    finally:
+        instrumentation.remove_callback(callback)
+        instrumentation.remove_callback(failing_callback)
+    readfile(XML)
+
+    assert calls == [('readfile', len(XML), 4)]
+
+
+def test_parse_catalog_schema_uris(tmpdir, instrumentation_enabled):
+    """Test that the bytes of the read catalog files and the number of their
+    entries are recorded.
+    """
+    catalog = tmpdir.join('catalog.xml')
+    next_catalog = tmpdir.join('next.xml')
+    construct_catalog_xml(
+        rewrite_rules={'http://a/': 'a/'}).write(str(next_catalog))
+    construct_catalog_xml(rewrite_rules={'http://b/': 'b/'},
+                          next_catalogs=['next.xml']).write(str(catalog))
+
+    parse_catalog_schema_uris(str(tmpdir), 'catalog.xml', use_cache=False)
+
+    stats = instrumentation.snapshot()['parse_catalog_schema_uris']
+    assert stats.bytes == catalog.size() + next_catalog.size()
+    assert stats.elements == 3
+
+
+def test_add_counts_nested(instrumentation_enabled):
+    """Test that add_counts adds to the innermost instrumented call only, and
+    does nothing outside instrumented calls.
+    """
+    @instrumentation.instrumented('inner')
+    def inner():
+        instrumentation.add_counts(size=1, elements=2)
+
+    @instrumentation.instrumented('outer')
+    def outer():
+        inner()
+        instrumentation.add_counts(size=10)
+
+    instrumentation.add_counts(size=100)
+    outer()
+
+    stats = instrumentation.snapshot()
+    assert stats['inner'][::2] == (1, 1)
+    assert stats['inner'].elements == 2
+    assert stats['outer'][2:] == (10, 0)
+
+
+def test_compare_trees_early_exit(instrumentation_enabled):
+    """Test that compare_trees records only the compared elements."""
+    tree1 = ET.fromstring('<root><a/><b/>' + '<c/>' * 1000 + '</root>')
+    tree2 = ET.fromstring('<root><a/><x/>' + '<c/>' * 1000 + '</root>')
+
+    assert not compare_trees(tree1, tree2)
+    assert compare_trees(tree1, tree1)
+
+    stats = instrumentation.snapshot()['compare_trees']
+    assert stats.elements == 2 * 3 + 2 * 1003
+
+
+def test_flatten_catalog(tmpdir, instrumentation_enabled):
+    """Test that flatten_catalog records the elements and bytes of both
+    the read and the written catalog files.
+    """
+    catalog = tmpdir.join('catalog.xml')
+    construct_catalog_xml(
+        base_path=str(tmpdir),
+        rewrite_rules={'http://a/': 'a/', 'http://b/': 'b/',
+                       'http://c/': 'c/d/'}).write(str(catalog))
+    output = tmpdir.join('flat.xml')
+
+    flatten_catalog(str(tmpdir), 'catalog.xml', str(output))
+
+    stats = instrumentation.snapshot()['flatten_catalog']
+    assert stats.bytes == catalog.size() + output.size()
+    # The three read entries, and the written root element, two groups and
+    # three rewriteURI elements
+    assert stats.elements == 9
@@ -1,11 +1,21 @@
 """Test schema_catalog-module."""
+import os
+import shutil
+
 import pytest
 
 import lxml.etree as ET
 
-from xml_helpers.schema_catalog import (construct_catalog_xml,
-                                        parse_catalog_schema_uris)
-from xml_helpers.utils import ensure_text, serialize
+from xml_helpers import schema_catalog
+from xml_helpers.schema_catalog import (CATALOG_CACHE, CATALOG_DOCTYPE,
+                                        SCHEMA_FILE_CACHE, CatalogResolver,
+                                        CatalogSchemaResolver,
+                                        construct_catalog_xml,
+                                        flatten_catalog,
+                                        load_catalog_snapshot,
+                                        parse_catalog_schema_uris,
+                                        write_catalog_xml)
+from xml_helpers.utils import ensure_text, serialize, xml_ns
 
 
 # pylint: disable=consider-using-dict-comprehension
@@ -76,3 +86,305 @@ def test_parse_catalog_schema_uris():
         './schemas_external/secondary_host/xml.xsd')
     assert uris['http://third_host/xml.xsd'] == (
         './schemas_external_two/third_host/xml.xsd')
+
+
+def test_parse_catalog_schema_uris_cache(tmpdir):
+    """Tests that the parsed catalog files are cached and that only the
+    modified catalog file is parsed again.
+    """
+    for name in ('catalog_main.xml', 'catalog_external.xml'):
+        shutil.copy(os.path.join('tests/data', name), tmpdir.strpath)
+    CATALOG_CACHE.clear()
+
+    uris = parse_catalog_schema_uris(tmpdir.strpath, 'catalog_main.xml')
+    assert CATALOG_CACHE.info().misses == 2
+    assert parse_catalog_schema_uris(
+        tmpdir.strpath, 'catalog_main.xml') == uris
+    assert CATALOG_CACHE.info().hits == 2
+
+    external = tmpdir.join('catalog_external.xml')
+    external.write_binary(external.read_binary().replace(
+        b'http://third_host/', b'http://fourth_host/'))
+    uris = parse_catalog_schema_uris(tmpdir.strpath, 'catalog_main.xml')
+    assert 'http://fourth_host/xml.xsd' in uris
+    assert CATALOG_CACHE.info().hits == 3
+    assert CATALOG_CACHE.info().misses == 3
+
+    CATALOG_CACHE.clear()
+    assert CATALOG_CACHE.info().currsize == 0
+
+
+@pytest.mark.parametrize(('uri', 'expected'), [
+    ('http://localhost/schemas/a.xsd', '/local/a.xsd'),
+    ('http://localhost/schemas/special/b.xsd', '/special/b.xsd'),
+    ('http://localhost/other.xsd', '/host/other.xsd'),
+    ('http://localhost/schemas/special', '/local/special'),
+    ('http://elsewhere/c.xsd', None),
+], ids=['Prefix match',
+        'Longest prefix wins',
+        'Shorter prefix',
+        'Partial match of a longer prefix',
+        'No match'])
+def test_catalog_resolver(uri, expected):
+    """Tests that the CatalogResolver uses the longest matching rule."""
+    resolver = CatalogResolver({
+        'http://localhost/': '/host/',
+        'http://localhost/schemas/': '/local/',
+        'http://localhost/schemas/special/': '/special/',
+    })
+    assert resolver.resolve(uri) == expected
+    assert resolver.resolve_many([uri, uri]) == [expected, expected]
+
+
+def test_catalog_resolver_from_catalog():
+    """Tests that the CatalogResolver can be built from a catalog file."""
+    resolver = CatalogResolver.from_catalog('tests/data/', 'catalog_main.xml')
+    assert resolver.resolve('http://third_host/xml.xsd') == (
+        './schemas_external_two/third_host/xml.xsd')
+
+
+def _write_catalog(path, rewrite_rules=None, next_catalogs=None):
+    """Write a catalog file with the given rewrite rules and nextCatalogs."""
+    catalog = construct_catalog_xml(base_path=os.path.dirname(path),
+                                    rewrite_rules=rewrite_rules,
+                                    next_catalogs=next_catalogs)
+    with open(path, 'wb') as out_file:
+        out_file.write(serialize(catalog))
+
+
+def test_parse_catalog_schema_uris_cycle(tmpdir):
+    """Tests that a cyclic nextCatalog chain is reported and that the
+    catalog files in it are read only once.
+    """
+    _write_catalog(tmpdir.join('a.xml').strpath,
+                   {'http://a/': 'a/', 'http://shared/': 'a/'},
+                   ['b.xml'])
+    _write_catalog(tmpdir.join('b.xml').strpath,
+                   {'http://b/': 'b/', 'http://shared/': 'b/'},
+                   ['a.xml'])
+
+    with pytest.warns(UserWarning, match='Catalog cycle detected'):
+        uris = parse_catalog_schema_uris(tmpdir.strpath, 'a.xml')
+
+    base = tmpdir.strpath
+    assert uris == {'http://a/': f'{base}/a/',
+                    'http://b/': f'{base}/b/',
+                    'http://shared/': f'{base}/b/'}
+
+
+def test_parse_catalog_schema_uris_deep_chain(tmpdir):
+    """Tests that a nextCatalog chain deeper than the recursion limit is
+    parsed and that the later entries override the earlier ones.
+    """
+    depth = 1500
+    for index in range(depth):
+        next_catalogs = [f'{index + 1}.xml'] if index + 1 < depth else None
+        _write_catalog(tmpdir.join(f'{index}.xml').strpath,
+                       {'http://shared/': f'{index}/',
+                        f'http://{index}/': f'{index}/'},
+                       next_catalogs)
+
+    uris = parse_catalog_schema_uris(tmpdir.strpath, '0.xml',
+                                     use_cache=False)
+    assert len(uris) == depth + 1
+    assert uris['http://shared/'] == f'{tmpdir.strpath}/{depth - 1}/'
+
+
+def test_parse_catalog_schema_uris_max_workers(tmpdir):
+    """Tests that reading the catalog files in parallel gives the same
+    result as reading them one at a time.
+    """
+    next_catalogs = []
+    for index in range(20):
+        subdir = tmpdir.mkdir(f'sub{index}')
+        _write_catalog(subdir.join('catalog.xml').strpath,
+                       {'http://shared/': f'{index}/',
+                        f'http://{index}/': f'{index}/'},
+                       ['../common.xml'])
+        next_catalogs.append(f'sub{index}/catalog.xml')
+    _write_catalog(tmpdir.join('common.xml').strpath,
+                   {'http://shared/': 'common/'})
+    _write_catalog(tmpdir.join('root.xml').strpath,
+                   {'http://shared/': 'root/'}, next_catalogs)
+
+    expected = parse_catalog_schema_uris(tmpdir.strpath, 'root.xml',
+                                         use_cache=False)
+    uris = parse_catalog_schema_uris(tmpdir.strpath, 'root.xml',
+                                     use_cache=False, max_workers=8)
+    assert uris == expected
+    assert list(uris.items()) == list(expected.items())
+    # common.xml is merged again after each sibling catalog linking to it
+    assert uris['http://shared/'] == f'{tmpdir.strpath}/common/'
+
+
+def test_parse_catalog_schema_uris_diamond(tmpdir, monkeypatch):
+    """Tests that a catalog file linked from two catalog files is parsed
+    only once, but merged again after each catalog linking to it.
+    """
+    _write_catalog(tmpdir.join('root.xml').strpath,
+                   {'http://shared/': 'root/'}, ['a.xml', 'b.xml'])
+    _write_catalog(tmpdir.join('a.xml').strpath,
+                   {'http://shared/': 'a/'}, ['common.xml'])
+    _write_catalog(tmpdir.join('b.xml').strpath,
+                   {'http://shared/': 'b/'}, ['common.xml'])
+    _write_catalog(tmpdir.join('common.xml').strpath,
+                   {'http://shared/': 'common/',
+                    'http://common/': 'common/'})
+
+    read_paths = []
+    # pylint: disable=protected-access
+    read_catalog = schema_catalog._read_catalog
+
+    def _counting_read_catalog(catalog_path):
+        read_paths.append(os.path.basename(catalog_path))
+        return read_catalog(catalog_path)
+
+    monkeypatch.setattr(schema_catalog, '_read_catalog',
+                        _counting_read_catalog)
+    uris = parse_catalog_schema_uris(tmpdir.strpath, 'root.xml',
+                                     use_cache=False)
+    base = tmpdir.strpath
+    assert uris == {'http://shared/': f'{base}/common/',
+                    'http://common/': f'{base}/common/'}
+    assert sorted(read_paths) == ['a.xml', 'b.xml', 'common.xml', 'root.xml']
+
+
+def test_catalog_snapshot(tmpdir, monkeypatch):
+    """Tests that the catalog snapshot is loaded without parsing the
+    catalog files, and that it is rebuilt when a catalog file changes.
+    """
+    for name in ('catalog_main.xml', 'catalog_external.xml'):
+        shutil.copy(os.path.join('tests/data', name), tmpdir.strpath)
+    snapshot_path = tmpdir.join('snapshot.json').strpath
+
+    uris = load_catalog_snapshot(snapshot_path, tmpdir.strpath,
+                                 'catalog_main.xml')
+    assert uris == parse_catalog_schema_uris('tests/data/',
+                                             'catalog_main.xml')
+    assert os.path.isfile(snapshot_path)
+
+    # The up to date snapshot is loaded without reading the catalog files
+    with monkeypatch.context() as patch:
+        patch.setattr(schema_catalog, '_walk_catalogs', None)
+        assert load_catalog_snapshot(snapshot_path, tmpdir.strpath,
+                                     'catalog_main.xml') == uris
+
+    external = tmpdir.join('catalog_external.xml')
+    external.write_binary(external.read_binary().replace(
+        b'http://third_host/', b'http://fourth_host/'))
+    uris = load_catalog_snapshot(snapshot_path, tmpdir.strpath,
+                                 'catalog_main.xml')
+    assert 'http://fourth_host/xml.xsd' in uris
+    assert 'http://third_host/xml.xsd' not in uris
+
+
+def test_flatten_catalog(tmpdir):
+    """Tests that the flattened catalog contains the effective rewrite
+    rules of the whole nextCatalog chain, grouped by xml:base.
+    """
+    output_path = tmpdir.join('flat.xml').strpath
+    flatten_catalog('tests/data/', 'catalog_main.xml', output_path)
+    flattened = parse_catalog_schema_uris(tmpdir.strpath, 'flat.xml')
+    assert flattened['http://third_host/xml.xsd'] == os.path.abspath(
+        'tests/data/schemas_external_two/third_host/xml.xsd')
+    assert len(flattened) == 5
+
+    # Entries rewriting URIs like a shorter matching entry are dropped
+    _write_catalog(tmpdir.join('next.xml').strpath,
+                   {'http://shared/': '/schemas/shared/',
+                    'http://shared/a.xsd': '/schemas/shared/a.xsd',
+                    'http://shared/b.xsd': '/schemas/other/b.xsd'})
+    _write_catalog(tmpdir.join('root.xml').strpath,
+                   {'http://shared/b.xsd': '/schemas/b.xsd',
+                    'http://local/': 'local/'},
+                   ['next.xml'])
+    catalog = flatten_catalog(tmpdir.strpath, 'root.xml', output_path)
+    flattened = parse_catalog_schema_uris(tmpdir.strpath, 'flat.xml')
+
+    assert flattened == {
+        'http://shared/b.xsd': '/schemas/other/b.xsd',
+        'http://local/': f'{tmpdir.strpath}/local/',
+        'http://shared/': '/schemas/shared/'}
+    assert [group.get(xml_ns('base')) for group in catalog.getroot()] == [
+        '/schemas/other/', f'{tmpdir.strpath}/', '/schemas/']
+    assert tmpdir.join('flat.xml').read_binary().startswith(
+        b"<?xml version='1.0' encoding='UTF-8'?>\n" + CATALOG_DOCTYPE)
+
+
+def test_catalog_schema_resolver(tmpdir):
+    """Tests that schemas imported through rewritten URLs are compiled
+    and that each schema file is read from disk only once.
+    """
+    schemas = tmpdir.mkdir('schemas')
+    schemas.join('base.xsd').write(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+        'targetNamespace="urn:base" elementFormDefault="qualified">'
+        '<xs:include schemaLocation="included.xsd"/></xs:schema>')
+    schemas.join('included.xsd').write(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+        'targetNamespace="urn:base" elementFormDefault="qualified">'
+        '<xs:element name="base" type="xs:string"/></xs:schema>')
+    tmpdir.join('main.xsd').write(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" '
+        'xmlns:b="urn:base" targetNamespace="urn:main" '
+        'elementFormDefault="qualified">'
+        '<xs:import namespace="urn:base" '
+        'schemaLocation="http://localhost.test/base.xsd"/>'
+        '<xs:element name="main"><xs:complexType><xs:sequence>'
+        '<xs:element ref="b:base"/>'
+        '</xs:sequence></xs:complexType></xs:element></xs:schema>')
+    _write_catalog(tmpdir.join('catalog.xml').strpath,
+                   {'http://localhost.test/': 'schemas/'})
+
+    SCHEMA_FILE_CACHE.clear()
+    for _ in range(2):
+        parser = ET.XMLParser()
+        parser.resolvers.add(CatalogSchemaResolver.from_catalog(
+            tmpdir.strpath, 'catalog.xml'))
+        schema = ET.XMLSchema(ET.parse(tmpdir.join('main.xsd').strpath,
+                                       parser))
+        assert schema.validate(ET.fromstring(
+            '<main xmlns="urn:main"><base xmlns="urn:base">A</base></main>'))
+
+    info = SCHEMA_FILE_CACHE.info()
+    assert (info.hits, info.misses) == (3, 3)
+
+
+@pytest.mark.parametrize(('rewrite_rules', 'next_catalogs'), [
+    ({'http://localhost.test/': 'schemas/',
+      'http://localhost.test/nön&"<>\t/': 'nön/'},
+     ['next.xml', 'other & next.xml']),
+    ({'http://localhost.test/': 'schemas/'}, None),
+], ids=['Rules and next catalogs', 'Rules only'])
+def test_write_catalog_xml(tmpdir, rewrite_rules, next_catalogs):
+    """Tests that the catalog written by write_catalog_xml is the same as
+    the one constructed by construct_catalog_xml, and that the rules can
+    be given as a generator.
+    """
+    catalog = construct_catalog_xml(base_path=tmpdir.strpath,
+                                    rewrite_rules=rewrite_rules,
+                                    next_catalogs=next_catalogs)
+    expected_path = tmpdir.join('expected.xml').strpath
+    catalog.write(expected_path, pretty_print=True, xml_declaration=True,
+                  encoding='UTF-8', doctype=CATALOG_DOCTYPE)
+
+    path = tmpdir.join('catalog.xml').strpath
+    write_catalog_xml(path, base_path=tmpdir.strpath,
+                      rewrite_rules=(rule for rule in rewrite_rules.items()),
+                      next_catalogs=next_catalogs)
+    with open(path, 'rb') as in_file, open(expected_path, 'rb') as expected:
+        assert in_file.read() == expected.read()
+
+    root = ET.parse(path).getroot()
+    assert root.attrib[xml_ns('base')] == tmpdir.strpath + '/'
+    assert [element.get('uriStartString') for element in root
+            if element.tag.endswith('rewriteURI')] == list(rewrite_rules)
+
+
+def test_write_catalog_xml_invalid(tmpdir):
+    """Tests that write_catalog_xml refuses to write rules that are not
+    allowed in XML.
+    """
+    with pytest.raises(ValueError):
+        write_catalog_xml(tmpdir.join('catalog.xml').strpath,
+                          rewrite_rules=[('http://localhost.test/\x00', '/')])
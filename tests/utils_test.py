@@ -1,5 +1,9 @@
 """Test for XML utils"""
 
+import asyncio
+import os
+import mmap
+import time
 from resource import getrusage, RUSAGE_SELF
 from io import BytesIO
 
@@ -37,6 +41,29 @@ def test_serialize():
     assert result == ser_xml
 
 
+@pytest.mark.parametrize('xml', [
+    b'<a:x xmlns:a="b"><a:y/></a:x>',
+    b'<?xml version="1.0"?>\n<!-- comment -->\n'
+    b'<x xmlns:unused="c">t\xc3\xa4<y>text</y>tail<z/></x>',
+], ids=['Namespaced', 'With comment and mixed content'])
+def test_serialize_to(tmpdir, xml):
+    """Test that serialize_to writes the same bytes as serialize for
+    element trees, root elements and subelements.
+    """
+    root = ET.fromstring(xml)
+    for element in (root.getroottree(), root, root[0]):
+        expected = u.serialize(element)
+
+        stream = BytesIO()
+        u.serialize_to(element, stream)
+        assert stream.getvalue() == expected
+
+        path = tmpdir.join('serialized.xml').strpath
+        u.serialize_to(element, path)
+        with open(path, 'rb') as in_file:
+            assert in_file.read() == expected
+
+
 def test_get_namespace():
     """test get_namespace"""
     elem = ET.Element(u.xsi_ns('a'))
@@ -138,3 +165,679 @@ def test_iter_elements_rss():
         element_count += 1
 
     assert element_count == 10001
+
+
+@pytest.mark.parametrize(('filters', 'expected'), [
+    ({'tag': 'm:file'}, ['1', '2', '4', '3']),
+    ({'tag': ['m:file', '{urn:m}div']}, ['1', 'div', '2', 'div', '4', '3']),
+    ({'path': 'm:fileGrp/m:file'}, ['1', '3']),
+    ({'path': '/root/m:fileGrp/m:file'}, ['1']),
+    ({'path': 'm:file/m:file'}, ['4']),
+], ids=['Tag', 'Multiple tags', 'Relative path', 'Absolute path',
+        'Nested path'])
+def test_iter_elements_filters(filters, expected):
+    """Test filtering the elements of the `iter_elements()` function."""
+    xmldata = b"""<root xmlns:m="urn:m">
+  <m:fileGrp><m:file n="1"><m:child/></m:file><m:div/></m:fileGrp>
+  <m:div><m:file n="2"/></m:div>
+  <other><m:fileGrp><m:file n="3"><m:file n="4"/></m:file></m:fileGrp></other>
+</root>"""
+    elements = list(u.iter_elements(BytesIO(xmldata),
+                                    namespaces={'m': 'urn:m'}, **filters))
+    assert [element.get('n', 'div') for element in elements] == expected
+
+    # Matching elements are yielded with their non-matching children
+    if expected[0] == '1':
+        assert len(elements[0]) == 1
+
+
+def test_iter_elements_filter_rss():
+    """Test memory usage is limited when filtering the elements of the
+    `iter_elements()` function.
+    """
+    xmldata = BytesIO("\n".join(
+        ['<?xml version="1.0" encoding="UTF-8" ?>'] +
+        ['<data>'] +
+        [f'<name value="value {value}">text {value}</name><skip/>'
+         for value in range(10000)] +
+        ['</data>']
+    ).encode("utf-8"))
+
+    element_count = 0
+    rss_before = getrusage(RUSAGE_SELF).ru_maxrss
+
+    for element in u.iter_elements(xmldata, path='/data/name'):
+        assert element.tag == 'name'
+        rss_usage = getrusage(RUSAGE_SELF).ru_maxrss - rss_before
+        assert rss_usage < 1  # KiB
+        element_count += 1
+
+    assert element_count == 10000
+
+
+@pytest.mark.parametrize('tag', ['late', 'missing'])
+def test_iter_elements_sparse_filter(tag):
+    """Test that the content before a sparse matching element is removed
+    from the tree before it is yielded by the `iter_elements()` function.
+    """
+    xmldata = BytesIO("\n".join(
+        ['<?xml version="1.0" encoding="UTF-8" ?>'] +
+        ['<data>'] +
+        [f'<skip value="value {value}"><child>text</child></skip>'
+         for value in range(100000)] +
+        ['<late/>', '</data>']
+    ).encode("utf-8"))
+
+    elements = []
+    for element in u.iter_elements(xmldata, tag=tag):
+        assert len(element.getparent()) == 1
+        elements.append(element.tag)
+
+    assert elements == ([tag] if tag == 'late' else [])
+
+
+def test_iter_records():
+    """Test the `iter_records()` function."""
+    xmldata = b"""<root xmlns:m="urn:m">
+  <m:file ID="a"> text <m:child/></m:file>
+  <m:file ID="b"/>
+</root>"""
+    records = list(u.iter_records(BytesIO(xmldata)))
+    assert records == [
+        ('{urn:m}child', {}, None, 2),
+        ('{urn:m}file', {'ID': 'a'}, 'text', 1),
+        ('{urn:m}file', {'ID': 'b'}, None, 1),
+        ('root', {}, '', 0),
+    ]
+    assert records[1].tag is records[2].tag
+
+    records = list(u.iter_records(BytesIO(xmldata), tag='m:file',
+                                  namespaces={'m': 'urn:m'}))
+    assert [record.attrib['ID'] for record in records] == ['a', 'b']
+    assert records[0].depth == 1
+
+
+@pytest.mark.parametrize('encoding', ['UTF-8', 'ISO-8859-1'])
+def test_checkpointed_iterator(tmpdir, encoding):
+    """Test that the `CheckpointedIterator` resumes from a checkpoint with
+    the elements following the checkpointed record.
+    """
+    path = tmpdir.join('records.xml').strpath
+    with open(path, 'wb') as out_file:
+        out_file.write("\n".join(
+            [f'<?xml version="1.0" encoding="{encoding}"?>'] +
+            ['<m:data xmlns:m="urn:m" m:note="a > b">'] +
+            [f'<m:rec n="{n}">tähti {n}<m:child m:n="{n}"/></m:rec>'
+             for n in range(10)] +
+            ['</m:data>']
+        ).encode(encoding))
+
+    def summary(element):
+        return (element.tag, dict(element.attrib), element.text,
+                element.tail)
+
+    with open(path, 'rb') as in_file:
+        expected = [summary(element)
+                    for element in u.iter_elements(in_file)]
+
+    iterator = u.CheckpointedIterator(path)
+    assert iterator.checkpoint is None
+    elements = []
+    checkpoints = []
+    for element in iterator:
+        elements.append(summary(element))
+        checkpoints.append(iterator.checkpoint)
+    assert elements == expected
+
+    # The checkpoint follows the last top-level record as soon as it has
+    # been yielded
+    assert checkpoints[0] is None
+    assert checkpoints[1] is not None
+    assert checkpoints[2] == checkpoints[1]
+
+    # Resuming from the checkpoint saved in the middle of a record
+    # continues with the descendants of the record
+    with open(path, 'rb') as in_file:
+        resumed = [summary(element) for element
+                   in u.CheckpointedIterator(in_file, checkpoints[8])]
+    assert resumed == expected[8:]
+
+    # Resuming from the checkpoint saved right after handling a top-level
+    # record continues with the next record
+    assert elements[9][:2] == ('{urn:m}rec', {'n': '4'})
+    with open(path, 'rb') as in_file:
+        resumed = [summary(element) for element
+                   in u.CheckpointedIterator(in_file, checkpoints[9])]
+    assert resumed == expected[10:]
+    assert resumed[1][:2] == ('{urn:m}rec', {'n': '5'})
+
+
+def test_checkpointed_iterator_tails():
+    """Test that the tails of the records are removed with them, so that
+    they are not collected by the root element.
+    """
+    xmldata = BytesIO(b'<root>\n' + b''.join(
+        b'  <rec><t>x</t>tail-t</rec>\n' for _ in range(1000)) + b'</root>')
+    elements = [(element.tag, element.text, element.tail)
+                for element in u.CheckpointedIterator(xmldata)]
+    assert elements[:2] == [('t', 'x', 'tail-t'), ('rec', None, '\n  ')]
+    assert elements[-1] == ('root', '\n  ', None)
+
+
+@pytest.mark.parametrize('reader', [True, False],
+                         ids=['Stream reader', 'Asynchronous iterable'])
+def test_aiter_elements(utf8_file, reader):
+    """Test that the `aiter_elements()` function yields the same elements
+    as the `iter_elements()` function.
+    """
+    with open(utf8_file, 'rb') as in_file:
+        data = in_file.read()
+
+    async def chunks():
+        for index in range(0, len(data), 7):
+            await asyncio.sleep(0)
+            yield data[index:index + 7]
+
+    async def collect():
+        if reader:
+            source = asyncio.StreamReader()
+            source.feed_data(data)
+            source.feed_eof()
+        else:
+            source = chunks()
+        return [(element.tag, element.text.strip(), len(element))
+                async for element in u.aiter_elements(source, chunk_size=5)]
+
+    expected = [(element.tag, element.text.strip(), len(element))
+                for element in u.iter_elements(utf8_file)]
+    assert asyncio.run(collect()) == expected
+
+
+def test_xml_index(tmpdir):
+    """Test looking up elements with an index written by the
+    `build_index()` function.
+    """
+    path = tmpdir.join('records.xml').strpath
+    with open(path, 'wb') as out_file:
+        out_file.write("\n".join(
+            ['<?xml version="1.0" encoding="UTF-8"?>'] +
+            ['<m:data xmlns:m="urn:m" xmlns="urn:default">'] +
+            [f'<m:rec ID="rec-{n:03}" note="a > b"><m:c>tähti {n}</m:c>'
+             f'<!-- <m:rec/> --></m:rec>' for n in range(100)] +
+            ['<m:rec><value/></m:rec>', '</m:data>']
+        ).encode('utf-8'))
+
+    index_path = u.build_index(path, tag='m:rec', namespaces={'m': 'urn:m'})
+    assert index_path == path + '.index'
+
+    with u.XMLIndex(path) as index:
+        element = index.find_by_id('rec-042')
+        assert element.tag == '{urn:m}rec'
+        assert element.get('note') == 'a > b'
+        assert element[0].text == 'tähti 42'
+        assert index.find_by_id('rec-100') is None
+
+        assert index.count('{urn:m}rec') == 101
+        assert index.find_by_tag('m:rec', 5, {'m': 'urn:m'}).get(
+            'ID') == 'rec-005'
+        assert index.find_by_tag('m:rec', 100, {'m': 'urn:m'})[0].tag == (
+            '{urn:default}value')
+        assert index.find_by_tag('{urn:m}rec', 101) is None
+        assert index.find_by_tag('{urn:m}c') is None
+
+    with open(path, 'ab') as out_file:
+        out_file.write(b'\n')
+    with pytest.raises(ValueError):
+        u.XMLIndex(path)
+
+
+@pytest.mark.parametrize(('tag', 'counts'), [
+    (None, {'{urn:m}rec': 100, '{urn:m}c': 0, 'value': 0}),
+    ('*', {'{urn:m}rec': 101, '{urn:m}c': 100, 'value': 1}),
+])
+def test_xml_index_tags(tmpdir, tag, counts):
+    """Test that by default only the elements with an ID are indexed by the
+    `build_index()` function, and all elements with the tag '*'.
+    """
+    path = tmpdir.join('records.xml').strpath
+    with open(path, 'wb') as out_file:
+        out_file.write("\n".join(
+            ['<m:data xmlns:m="urn:m">'] +
+            [f'<m:rec ID="rec-{n}"><m:c>{n}</m:c></m:rec>'
+             for n in range(100)] +
+            ['<m:rec><value/></m:rec>', '</m:data>']
+        ).encode('utf-8'))
+
+    u.build_index(path, tag=tag)
+
+    with u.XMLIndex(path) as index:
+        assert {name: index.count(name) for name in counts} == counts
+        assert index.find_by_id('rec-99')[0].text == '99'
+        assert index.find_by_tag('{urn:m}rec', 99).get('ID') == 'rec-99'
+
+
+def _record_number(element):
+    """Return the record number of a record element."""
+    return int(element.get('n')) * 2
+
+
+def test_split_records():
+    """Test that the records split by the `split_records()` function are
+    well-formed and contain the namespace declarations they need.
+    """
+    xmldata = b"""<data xmlns:m="urn:m" xmlns:xsi="urn:xsi">
+  <m:dmdSec n="1" xsi:type="m:type"><m:child/></m:dmdSec>tail
+  <other/>
+  <m:dmdSec n="2"/>
+</data>"""
+    shards = list(u.split_records(BytesIO(xmldata), tag='{urn:m}dmdSec'))
+    assert len(shards) == 2
+
+    record = ET.fromstring(shards[0])
+    assert record.tag == '{urn:m}dmdSec'
+    assert record.nsmap == {'m': 'urn:m', 'xsi': 'urn:xsi'}
+    assert record[0].tag == '{urn:m}child'
+    assert b'tail' not in shards[0]
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_map_records(workers):
+    """Test that the `map_records()` function returns the results in the
+    order of the records.
+    """
+    xmldata = "\n".join(
+        ['<data xmlns:m="urn:m">'] +
+        [f'<m:rec n="{n}"><m:rec n="nested"/></m:rec>' for n in range(100)] +
+        ['</data>']
+    ).encode('utf-8')
+
+    results = u.map_records(BytesIO(xmldata), _record_number,
+                            path='/data/m:rec', namespaces={'m': 'urn:m'},
+                            workers=workers, chunksize=7)
+    assert list(results) == [n * 2 for n in range(100)]
+
+
+def _count_elements(path):
+    """Return the number of elements in the XML file."""
+    return sum(1 for _ in u.iter_elements(path))
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_map_files(tmpdir, workers):
+    """Test that the `map_files()` function returns a result or an error
+    for each of the files.
+    """
+    paths = []
+    for index in range(20):
+        path = tmpdir.join(f'{index}.xml').strpath
+        with open(path, 'wb') as out_file:
+            out_file.write(b'<root>' + b'<child/>' * index + b'</root>')
+        paths.append(path)
+    malformed = tmpdir.join('malformed.xml').strpath
+    with open(malformed, 'wb') as out_file:
+        out_file.write(b'<root>')
+
+    results = list(u.map_files(iter(paths + [malformed]), _count_elements,
+                               workers=workers, chunksize=3,
+                               max_in_flight=2))
+    assert len(results) == 21
+
+    results = {result.path: result for result in results}
+    for index, path in enumerate(paths):
+        assert results[path] == (path, index + 1, None)
+    assert results[malformed].result is None
+    assert results[malformed].error.startswith('XMLSyntaxError')
+
+
+def _read_tree(path):
+    """Return the unpicklable tree of the XML file."""
+    return u.readfile(path)
+
+
+def _exit_on_crash(path):
+    """Terminate the worker process for a file named crash.xml."""
+    if path.endswith('crash.xml'):
+        os._exit(1)  # pylint: disable=protected-access
+    return path
+
+
+def test_map_files_unpicklable(tmpdir):
+    """Test that unpicklable results are reported as errors of their files
+    by the `map_files()` function.
+    """
+    paths = []
+    for index in range(4):
+        path = tmpdir.join(f'{index}.xml').strpath
+        with open(path, 'wb') as out_file:
+            out_file.write(b'<root/>')
+        paths.append(path)
+
+    results = list(u.map_files(paths, _read_tree, workers=2, chunksize=2))
+    assert sorted(result.path for result in results) == paths
+    for result in results:
+        assert result.result is None
+        assert 'pickle' in result.error
+
+
+def test_map_files_crash(tmpdir):
+    """Test that a crashed worker process fails only the chunks in
+    processing, and the rest of the files are processed in a new pool.
+    """
+    paths = [tmpdir.join(f'{index}.xml').strpath for index in range(6)]
+    paths[0] = tmpdir.join('crash.xml').strpath
+
+    results = list(u.map_files(paths, _exit_on_crash, workers=2,
+                               chunksize=1, max_in_flight=1))
+    assert [result.path for result in results] == paths
+    assert results[0].error.startswith('BrokenProcessPool')
+    assert results[1:] == [(path, path, None) for path in paths[1:]]
+
+
+def test_compare_trees_deep():
+    """Test that trees deeper than the recursion limit can be compared."""
+    trees = []
+    for _ in range(2):
+        root = element = ET.Element('root')
+        for depth in range(5000):
+            element = ET.SubElement(element, 'child', depth=str(depth))
+        element.text = 'leaf'
+        trees.append(root)
+
+    assert u.compare_trees(*trees)
+    element.text = 'other'
+    assert not u.compare_trees(*trees)
+
+
+@pytest.mark.parametrize(('xml', 'expected'), [
+    ('mixed_content', None),
+    ('extra_element', '/root[1]'),
+    ('extra_attrib', '/root[1]'),
+    ('extra_text', '/root[1]/child[2]'),
+    ('child_incorrect_attrib', '/root[1]/child[2]'),
+])
+def test_compare_files(tmpdir, compare_tree_xml, xml, expected):
+    """Test that the `compare_files()` function finds the first difference
+    between the files, and agrees with the `compare_trees()` function.
+    """
+    path1 = tmpdir.join('base.xml').strpath
+    path2 = tmpdir.join('other.xml').strpath
+    with open(path1, 'wb') as out_file:
+        out_file.write(compare_tree_xml.base())
+    with open(path2, 'wb') as out_file:
+        out_file.write(getattr(compare_tree_xml, xml)())
+
+    assert u.compare_files(path1, path2) == expected
+    assert u.compare_trees(
+        u.readfile(path1).getroot(),
+        u.readfile(path2).getroot()) == (expected is None)
+
+
+@pytest.mark.parametrize(('xml', 'expected'), [
+    (b'<r><a>1</a><?pi y?>t<b x="1 "/></r>', None),
+    (b'<r>\n<a> 1 </a><?pi y ?>t <b x=" 1"/></r>', None),
+    (b'<r><a>1</a><?pi z?><b x="1"/></r>',
+     '/r[1]/processing-instruction()[1]'),
+    (b'<r><a>1</a><?pi y?>t<c x="1"/></r>', '/r[1]/b[1]'),
+    (b'<r><a> 2</a><?pi y?>t<b x="1"/></r>', '/r[1]/a[1]'),
+    (b'<r><a>1</a><?pi y?>t<b x="1"/><b/></r>', '/r[1]'),
+    (b'<r><a>1</a><?pi y?>t<b x="1"/></r><?after?>', None),
+], ids=['Identical', 'Whitespace', 'Processing instruction', 'Tag',
+        'Text', 'Extra element', 'Processing instruction after root'])
+def test_compare_files_path(xml, expected):
+    """Test the paths of the differences found by the `compare_files()`
+    function. The paths refer to the elements of the first file.
+    """
+    base = b'<r><a>1</a><?pi y?>t<b x="1"/></r>'
+    assert u.compare_files(BytesIO(base), BytesIO(xml)) == expected
+
+
+@pytest.mark.parametrize('xml', [
+    'mixed_content',
+    'extra_element',
+    'extra_attrib',
+    'extra_text',
+    'child_incorrect_attrib',
+    'none_text_content',
+])
+def test_fingerprint(compare_tree_xml, xml):
+    """Test that the fingerprints are equal when the `compare_trees()`
+    function finds the trees equal.
+    """
+    tree1 = ET.fromstring(compare_tree_xml.base())
+    tree2 = ET.fromstring(getattr(compare_tree_xml, xml)())
+    assert (u.fingerprint(tree1) == u.fingerprint(tree2)) == (
+        u.compare_trees(tree1, tree2))
+    assert u.fingerprint(tree1.getroottree()) == u.fingerprint(tree1)
+
+
+def test_iter_fingerprints():
+    """Test that the `iter_fingerprints()` function yields the fingerprints
+    of all subtrees, children first.
+    """
+    root = ET.fromstring(
+        b'<root><a x="1"><b/></a><!--c--><a x=" 1 "><b/></a></root>')
+    fingerprints = list(u.iter_fingerprints(root))
+
+    assert [element.tag for element, _ in fingerprints] == [
+        'b', 'a', ET.Comment, 'b', 'a', 'root']
+    assert fingerprints[1][1] == fingerprints[4][1]
+    assert fingerprints[-1][1] == u.fingerprint(root)
+    assert len({digest for _, digest in fingerprints}) == 4
+
+
+def test_readfile_sources(utf8_file):
+    """Test that `readfile()` reads files, file objects, bytes and memory
+    maps, and reuses its parsers.
+    """
+    expected = ET.tostring(u.readfile(utf8_file))
+    with open(utf8_file, 'rb') as in_file:
+        assert ET.tostring(u.readfile(in_file)) == expected
+        in_file.seek(0)
+        data = in_file.read()
+        with mmap.mmap(in_file.fileno(), 0,
+                       access=mmap.ACCESS_READ) as memory_map:
+            assert ET.tostring(u.readfile(memory_map)) == expected
+    assert ET.tostring(u.readfile(data)) == expected
+    assert ET.tostring(u.readfile(bytearray(data))) == expected
+
+    tree1 = u.readfile(b'<a>  <b/> <!-- c --></a>')
+    tree2 = u.readfile(b'<a>  <b/> <!-- c --></a>')
+    assert ET.tostring(tree1) == b'<a><b/></a>'
+    assert tree1.parser is tree2.parser
+    assert u.readfile(b'<a/>', huge_tree=True).parser is not tree1.parser
+
+
+def test_readfile_options():
+    """Test the parser options of `readfile()`."""
+    with pytest.raises(ET.XMLSyntaxError):
+        u.readfile(b'<a><b></a>')
+    assert u.readfile(b'<a><b></a>', recover=True).getroot()[0].tag == 'b'
+
+    xml = b'<!DOCTYPE a [<!ENTITY e "value">]><a>&e;</a>'
+    assert u.readfile(xml).getroot().text == 'value'
+    assert u.readfile(xml, resolve_entities=False).getroot().text is None
+
+
+def test_readfile_cache(tmpdir):
+    """Test that `readfile()` caches the trees of files, returns copies of
+    them and notices changes to the files.
+    """
+    u.READFILE_CACHE.clear()
+    path = tmpdir.join('cached.xml')
+    path.write('<?xml version="1.0" encoding="UTF-8"?><a><b>text</b></a>')
+
+    tree = u.readfile(str(path), cache=True)
+    tree.getroot()[0].text = 'changed'
+    assert u.readfile(str(path), cache=True).getroot()[0].text == 'text'
+    assert u.readfile(str(path)).getroot()[0].text == 'text'
+    info = u.READFILE_CACHE.info()
+    assert (info.hits, info.misses, len(u.READFILE_CACHE)) == (1, 1, 1)
+
+    path.write('<a><b>new text</b></a>')
+    assert u.readfile(str(path), cache=True).getroot()[0].text == 'new text'
+    assert u.READFILE_CACHE.info().misses == 2
+    assert u.readfile(str(path), cache=True).docinfo.URL == str(path)
+    u.READFILE_CACHE.clear()
+
+
+def test_readfile_cache_large_file(tmpdir):
+    """Test that the size of the tree of a realistically sized file is
+    estimated in linear time when caching it.
+    """
+    u.READFILE_CACHE.clear()
+    path = tmpdir.join('large.xml')
+    path.write('<data>' + ''.join(
+        f'<record ID="id{index}" type="item"><title>Record {index}</title>'
+        f'<value>{index}</value></record>'
+        for index in range(100000)) + '</data>')
+
+    start = time.perf_counter()
+    u.readfile(path.strpath, cache=True)
+    assert time.perf_counter() - start < 10
+
+    # 300001 elements, 200000 attributes and 200000 text nodes
+    assert u.READFILE_CACHE.info().currsize == (
+        path.size() + 700001 * u.NODE_SIZE)
+    u.READFILE_CACHE.clear()
+
+
+def test_readfile_cache_eviction(tmpdir):
+    """Test that the least recently used trees are evicted from the cache
+    when it grows over its size.
+    """
+    u.READFILE_CACHE.clear()
+    maxsize = u.READFILE_CACHE.maxsize
+    paths = []
+    for index in range(3):
+        path = tmpdir.join('file%d.xml' % index)
+        path.write('<a><b>%d</b></a>' % index)
+        paths.append(str(path))
+    try:
+        u.READFILE_CACHE.maxsize = 2 * (16 + 4 * u.NODE_SIZE)
+        for path in paths:
+            u.readfile(path, cache=True)
+        assert u.READFILE_CACHE.info().evictions == 1
+        assert u.readfile(paths[2], cache=True).getroot()[0].text == '2'
+        assert u.READFILE_CACHE.info().hits == 1
+        u.readfile(paths[0], cache=True)
+        assert u.READFILE_CACHE.info().misses == 4
+    finally:
+        u.READFILE_CACHE.maxsize = maxsize
+        u.READFILE_CACHE.clear()
+
+
+@pytest.mark.parametrize(('filters', 'expected'), [
+    ({'tag': 'm:amdSec'},
+     b'<root xmlns:m="urn:m"><m:amdSec ID="a"><m:techMD>1</m:techMD>'
+     b'</m:amdSec></root>'),
+    ({'tag': ['m:hdr', 'm:file']},
+     b'<root xmlns:m="urn:m"><m:hdr>header</m:hdr><m:fileSec>'
+     b'<m:file ID="f1"/><m:file ID="f2"><m:file ID="f3"/></m:file>'
+     b'</m:fileSec></root>'),
+    ({'path': '/root/m:fileSec/m:file'},
+     b'<root xmlns:m="urn:m"><m:fileSec><m:file ID="f1"/>'
+     b'<m:file ID="f2"><m:file ID="f3"/></m:file></m:fileSec></root>'),
+    ({'path': 'm:file/m:file'},
+     b'<root xmlns:m="urn:m"><m:fileSec><m:file ID="f2">'
+     b'<m:file ID="f3"/></m:file></m:fileSec></root>'),
+    ({'tag': 'm:missing'}, b'<root xmlns:m="urn:m"/>'),
+], ids=['Tag', 'Multiple tags', 'Absolute path', 'Nested path',
+        'No match'])
+def test_readfile_partial(filters, expected):
+    """Test that `readfile_partial()` keeps only the selected elements and
+    their ancestors, without blanks and comments.
+    """
+    xmldata = b"""<?xml version="1.0" encoding="UTF-8"?>
+<root xmlns:m="urn:m">
+  <!-- comment -->
+  <m:hdr>header</m:hdr>
+  <m:dmdSec><m:data>skipped</m:data></m:dmdSec>
+  <m:amdSec ID="a">
+    <m:techMD>1</m:techMD>
+  </m:amdSec>
+  <m:fileSec>
+    <m:file ID="f1"/>
+    <m:file ID="f2"><m:file ID="f3"/></m:file>
+  </m:fileSec>
+</root>"""
+    tree = u.readfile_partial(BytesIO(xmldata), namespaces={'m': 'urn:m'},
+                              **filters)
+    assert ET.tostring(tree) == expected
+
+    with pytest.raises(ValueError):
+        u.readfile_partial(BytesIO(xmldata))
+
+
+def test_readfile_partial_rss():
+    """Test that memory usage of `readfile_partial()` is bounded by the
+    selected content.
+    """
+    xmldata = BytesIO("\n".join(
+        ['<?xml version="1.0" encoding="UTF-8" ?>'] +
+        ['<data>'] +
+        [f'<name value="value {value}">text {value}</name>'
+         for value in range(100000)] +
+        ['<header>selected</header>', '</data>']
+    ).encode("utf-8"))
+
+    rss_before = getrusage(RUSAGE_SELF).ru_maxrss
+    tree = u.readfile_partial(xmldata, tag='header')
+    assert getrusage(RUSAGE_SELF).ru_maxrss - rss_before < 1024  # KiB
+
+    assert [element.tag for element in tree.iter()] == ['data', 'header']
+
+
+@pytest.mark.parametrize(('declared', 'codec'), [
+    ('ISO-8859-15', 'iso-8859-15'),
+    ('windows-1252', 'cp1252'),
+    ('UTF-16', 'utf-16'),
+    ('UTF-16BE', 'utf-16-be'),
+    ('UTF-32', 'utf-32'),
+    ('UTF-8', 'utf-8-sig'),
+    ('UTF-8', 'utf-8'),
+], ids=['Latin-9', 'Windows-1252', 'UTF-16 with BOM', 'UTF-16 without BOM',
+        'UTF-32', 'UTF-8 with BOM', 'UTF-8'])
+@pytest.mark.parametrize('chunk_size', [1, 65536])
+def test_utf8_reader(declared, codec, chunk_size):
+    """Test that `UTF8Reader` detects the encoding, converts the data to
+    UTF-8 and rewrites the encoding declaration.
+    """
+    text = (f'<?xml version="1.0" encoding="{declared}"?>\n'
+            '<root a="ä">€ö ü</root>\n')
+    reader = u.UTF8Reader(BytesIO(text.encode(codec)), chunk_size=chunk_size)
+    data = b''.join(iter(lambda: reader.read(5), b''))
+    assert data == text.replace(declared, 'UTF-8').encode('utf-8')
+
+    root = u.readfile(u.UTF8Reader(BytesIO(text.encode(codec)),
+                                   chunk_size=chunk_size)).getroot()
+    assert (root.get('a'), root.text) == ('ä', '€ö ü')
+
+
+def test_utf8_reader_unknown_encoding():
+    """Test that unknown encodings are refused."""
+    with pytest.raises(ValueError):
+        u.UTF8Reader(BytesIO(b'<?xml version="1.0" encoding="x-foo"?><a/>'))
+
+
+def test_transcode_to_utf8(tmpdir):
+    """Test `transcode_to_utf8()` and streaming the transcoded data to
+    `iter_elements()`.
+    """
+    source = tmpdir.join('latin1.xml')
+    source.write_binary(
+        '<?xml version="1.0" encoding=\'ISO-8859-1\'?>\n<data>'.encode() +
+        ''.join(f'<name value="ä {value}"/>'
+                for value in range(1000)).encode('latin-1') +
+        b'</data>')
+    destination = tmpdir.join('utf8.xml')
+
+    assert u.transcode_to_utf8(source.strpath, destination.strpath,
+                               chunk_size=100) == 'ISO-8859-1'
+    assert destination.read_binary().startswith(
+        b"<?xml version=\"1.0\" encoding='UTF-8'?>\n<data><name value=\"\xc3")
+
+    with u.UTF8Reader(source.strpath) as reader:
+        values = [element.get('value')
+                  for element in u.iter_elements(reader)]
+    assert values[:2] == ['ä 0', 'ä 1']
+    assert len(values) == 1001
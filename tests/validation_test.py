@@ -0,0 +1,86 @@
+"""Test validation-module."""
+import itertools
+
+import pytest
+
+from xml_helpers.validation import (SCHEMA_CACHE, get_schema, validate,
+                                    validate_many)
+
+SCHEMA = b"""<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="root">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="child" type="xs:integer" maxOccurs="unbounded"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>"""
+
+
+@pytest.fixture
+def xml_files(tmpdir):
+    """Write a schema and valid, invalid and malformed XML files."""
+    tmpdir.join('schema.xsd').write_binary(SCHEMA)
+    tmpdir.join('valid.xml').write_binary(
+        b'<root><child>1</child><child>2</child></root>')
+    tmpdir.join('invalid.xml').write_binary(
+        b'<root><child>A</child></root>')
+    tmpdir.join('malformed.xml').write_binary(b'<root><child>')
+    return tmpdir
+
+
+def test_get_schema(xml_files):
+    """Tests that the compiled schemas are cached."""
+    SCHEMA_CACHE.clear()
+    schema_path = xml_files.join('schema.xsd').strpath
+    assert get_schema(schema_path) is get_schema(schema_path)
+    assert SCHEMA_CACHE.info().misses == 1
+    assert SCHEMA_CACHE.info().hits == 1
+
+
+def test_validate(xml_files):
+    """Tests the validation results of valid, invalid, malformed and
+    missing files.
+    """
+    schema_path = xml_files.join('schema.xsd').strpath
+
+    result = validate(xml_files.join('valid.xml').strpath, schema_path)
+    assert result['valid']
+    assert result['errors'] == []
+
+    result = validate(xml_files.join('invalid.xml').strpath, schema_path)
+    assert not result['valid']
+    assert result['errors'][0]['line'] == 1
+    assert "'A' is not a valid value" in result['errors'][0]['message']
+
+    for name in ('malformed.xml', 'missing.xml'):
+        result = validate(xml_files.join(name).strpath, schema_path)
+        assert not result['valid']
+        assert result['errors']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_validate_many(xml_files, workers):
+    """Tests that the results are returned in the order of the paths."""
+    paths = [xml_files.join(name).strpath
+             for name in ('valid.xml', 'invalid.xml', 'malformed.xml') * 3]
+    results = list(validate_many(paths,
+                                 xml_files.join('schema.xsd').strpath,
+                                 workers=workers, chunksize=2))
+
+    assert [result['filename'] for result in results] == paths
+    assert [result['valid'] for result in results] == [True, False, False] * 3
+
+
+def test_validate_many_unbounded(xml_files):
+    """Tests that the paths are consumed lazily, so that the results of an
+    endless generator of paths are yielded.
+    """
+    paths = itertools.cycle([xml_files.join('valid.xml').strpath,
+                             xml_files.join('invalid.xml').strpath])
+    results = validate_many(paths, xml_files.join('schema.xsd').strpath,
+                            workers=2, chunksize=2, max_in_flight=2)
+    valid = [result['valid'] for result in itertools.islice(results, 10)]
+    results.close()
+
+    assert valid == [True, False] * 5
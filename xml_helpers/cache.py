@@ -0,0 +1,101 @@
+"""A bounded, thread-safe LRU cache used by the process-wide caches of
+xml-helpers.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple('CacheInfo',
+                       ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class LRUCache:
+    """Least recently used cache with hit, miss and eviction counters.
+
+    The size of the cache is the sum of the weights of the cached values.
+    By default every value weighs one, so that *maxsize* limits the number of
+    entries. A *weigher* can be given to limit e.g. the approximate number of
+    bytes held by the cache instead.
+
+    The ``maxsize`` attribute can be changed at any time; the cache is
+    trimmed down to the new size on the next insertion.
+    """
+
+    def __init__(self, maxsize, weigher=None):
+        """Initialize the cache.
+
+        :param maxsize: Maximum total weight of the cached values
+        :param weigher: Function returning the weight of a value. Defaults
+            to one per value.
+        """
+        self.maxsize = maxsize
+        self._weigher = weigher
+        self._entries = OrderedDict()
+        self._currsize = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the cached value of *key* and mark it most recently used.
+
+        :param key: Key of the value
+        :param default: Value returned if *key* is not cached
+        :returns: Cached value or *default*
+        """
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value):
+        """Add *value* to the cache, evicting least recently used values
+        when the cache would grow over its maximum size. A value heavier
+        than the whole cache is not cached at all.
+
+        :param key: Key of the value
+        :param value: Value to cache
+        """
+        weight = self._weigher(value) if self._weigher else 1
+        with self._lock:
+            if key in self._entries:
+                self._currsize -= self._entries.pop(key)[1]
+            if weight > self.maxsize:
+                return
+            self._entries[key] = (value, weight)
+            self._currsize += weight
+            while self._currsize > self.maxsize:
+                _, (_, evicted_weight) = self._entries.popitem(last=False)
+                self._currsize -= evicted_weight
+                self._evictions += 1
+
+    def clear(self):
+        """Remove all values from the cache and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._currsize = 0
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def info(self):
+        """Return the cache statistics.
+
+        :returns: CacheInfo named tuple with hits, misses, evictions,
+            maxsize and currsize
+        """
+        with self._lock:
+            return CacheInfo(self._hits, self._misses, self._evictions,
+                             self.maxsize, self._currsize)
@@ -1,15 +1,49 @@
 """A module containing XML catalog related operations."""
 
+import json
 import os
+import re
+import tempfile
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
 
 import lxml.etree as ET
 
+from xml_helpers.cache import LRUCache
+from xml_helpers.instrumentation import (add_counts, instrumented,
+                                         is_enabled, source_size)
 from xml_helpers.utils import ensure_text, xml_ns
 
 # pylint: disable=line-too-long
 CATALOG_DOCTYPE = b'<!DOCTYPE catalog PUBLIC "-//OASIS//DTD XML Catalogs V1.0//EN" "catalog.dtd">'  # noqa: E501
 
+CATALOG_NS = 'urn:oasis:names:tc:entity:xmlns:xml:catalog'
+REWRITE_URI = f'{{{CATALOG_NS}}}rewriteURI'
+NEXT_CATALOG = f'{{{CATALOG_NS}}}nextCatalog'
+XML_BASE = xml_ns('base')
 
+# Version of the catalog snapshot file format
+SNAPSHOT_VERSION = 1
+
+# Characters that are not allowed in XML, and characters that have to be
+# escaped in attribute values, used by write_catalog_xml
+INVALID_XML_CHARACTERS = re.compile(
+    '[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+ATTRIBUTE_SPECIAL_CHARACTERS = re.compile('[&<>"\n\r\t]')
+
+# Process-wide cache of parsed catalog files. The maximum number of cached
+# catalog files can be changed by setting CATALOG_CACHE.maxsize.
+CATALOG_CACHE = LRUCache(maxsize=1024)
+
+# Process-wide cache of schema file contents served by
+# CatalogSchemaResolver. The size of the cache is limited to 64 MiB of file
+# contents by default.
+SCHEMA_FILE_CACHE = LRUCache(maxsize=64 * 1024 * 1024, weigher=len)
+
+
+@instrumented('construct_catalog_xml')
 def construct_catalog_xml(base_path='.',
                           rewrite_rules=None,
                           next_catalogs=None):
@@ -58,51 +92,621 @@ def construct_catalog_xml(base_path='.',
             catalog_element.attrib["catalog"] = catalog
             root.append(catalog_element)
 
+    add_counts(elements=1 + len(rewrite_rules or ()) +
+               len(next_catalogs or ()))
     return ET.ElementTree(root)
 
 
-def parse_catalog_schema_uris(base_path, catalog_relpath, schema_uris=None):
+@instrumented('write_catalog_xml', lambda result, destination, *args,
+              **kwargs: (source_size(destination), 0))
+def write_catalog_xml(destination, base_path='.', rewrite_rules=None,
+                      next_catalogs=None):
+    """Writes a catalog file incrementally, without constructing the
+    catalog in memory.
+
+    The written catalog is the same as the catalog constructed with
+    construct_catalog_xml and written pretty printed with the XML
+    declaration and CATALOG_DOCTYPE, but the rewrite rules and next catalogs
+    can be given as generators, so that the memory use does not depend on
+    the number of the rules.
+
+    :param destination: Path of the catalog file, or a binary file object
+    :param base_path: The base path of the catalog. Expected to be a directory.
+    :param rewrite_rules: Rewrite entries to be added to the catalog, either
+        as a dict like in construct_catalog_xml, or as an iterable of
+        (uriStartString, rewritePrefix) pairs
+    :param next_catalogs: Iterable of catalog filepaths that this catalog is
+        expected to link to.
+    :raises: ValueError if a rule or a filepath contains characters not
+        allowed in XML
+    """
+    if rewrite_rules is None:
+        rewrite_rules = ()
+    elif hasattr(rewrite_rules, 'items'):
+        rewrite_rules = rewrite_rules.items()
+    if next_catalogs is None:
+        next_catalogs = ()
+
+    root = ET.Element('catalog')
+    root.attrib['xmlns'] = CATALOG_NS
+    root.attrib['prefer'] = 'public'
+    root.attrib[xml_ns('base')] = os.path.abspath(base_path).rstrip(
+        '/') + '/'
+
+    if hasattr(destination, 'write'):
+        _write_catalog_lines(destination, root, rewrite_rules, next_catalogs)
+    else:
+        with open(destination, 'wb') as catalog_file:
+            _write_catalog_lines(catalog_file, root, rewrite_rules,
+                                 next_catalogs)
+
+
+def _write_catalog_lines(catalog_file, root, rewrite_rules, next_catalogs):
+    """Writes the lines of a catalog file, see write_catalog_xml.
+
+    :param catalog_file: Binary file object to write to
+    :param root: The catalog element without children
+    :param rewrite_rules: Iterable of (uriStartString, rewritePrefix) pairs
+    :param next_catalogs: Iterable of catalog filepaths
+    """
+    catalog_file.write(b"<?xml version='1.0' encoding='UTF-8'?>\n" +
+                       CATALOG_DOCTYPE + b'\n')
+    catalog_file.write(ET.tostring(root)[:-2] + b'>\n')
+    for start_string, rewrite_prefix in rewrite_rules:
+        catalog_file.write(
+            '  <rewriteURI uriStartString="{}" rewritePrefix="{}"/>\n'.format(
+                _escape_attribute(ensure_text(start_string)),
+                _escape_attribute(ensure_text(rewrite_prefix))
+            ).encode('utf-8'))
+    for catalog in next_catalogs:
+        catalog_file.write('  <nextCatalog catalog="{}"/>\n'.format(
+            _escape_attribute(catalog)).encode('utf-8'))
+    catalog_file.write(b'</catalog>\n')
+
+
+def _escape_attribute(value):
+    """Escapes a string for a double quoted attribute value the way lxml
+    does.
+
+    :param value: Attribute value
+    :returns: Escaped attribute value
+    :raises: ValueError if the value contains characters not allowed in XML
+    """
+    if INVALID_XML_CHARACTERS.search(value):
+        raise ValueError(
+            'All strings must be XML compatible: Unicode or ASCII, no NULL '
+            'bytes or control characters')
+    if ATTRIBUTE_SPECIAL_CHARACTERS.search(value) is None:
+        return value
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&quot;').replace('\n', '&#10;').replace(
+            '\r', '&#13;').replace('\t', '&#9;')
+
+
+@instrumented('flatten_catalog', lambda catalog, base_path, catalog_relpath,
+              output_path, *args, **kwargs: (source_size(output_path), 0))
+def flatten_catalog(base_path, catalog_relpath, output_path,
+                    max_workers=None):
+    """Writes a single catalog file containing the rewrite rules of a
+    catalog and all the catalog files linked to it.
+
+    The rewriteURI entries of the whole nextCatalog chain are merged, so
+    that duplicate entries and entries overridden by later catalog files
+    are dropped. Entries that rewrite URIs exactly as a shorter matching
+    entry would are dropped too. Relative rewritePrefixes are resolved
+    against the locations of their catalog files, and the entries are
+    grouped by their directories into group elements with xml:base, so
+    that the flattened catalog can be placed anywhere.
+
+    Pointing XML_CATALOG_FILES to the flattened catalog spares libxml2
+    from following the nextCatalog chain on every schema lookup.
+
+    :param base_path: The base path of the catalog file location
+    :param catalog_relpath: The relative path to the catalog file from
+                            the base_path
+    :param output_path: Path of the flattened catalog file to write
+    :param max_workers: Number of threads used for reading the catalog
+                        files, see parse_catalog_schema_uris
+    :returns: ElementTree-object of the flattened catalog
+    """
+    schema_uris = _parse_absolute_schema_uris(base_path, catalog_relpath,
+                                              max_workers)
+
+    # Drop the rules that the longest shorter matching rule makes
+    # redundant: rewriting the start string without its last character
+    # with the other rules gives the same result.
+    resolver = CatalogResolver(schema_uris)
+    groups = {}
+    for start_string, rewrite_path in schema_uris.items():
+        if start_string:
+            shorter_match = resolver.resolve(start_string[:-1])
+            if shorter_match is not None and \
+                    shorter_match + start_string[-1] == rewrite_path:
+                continue
+
+        split_index = rewrite_path.rstrip('/').rfind('/') + 1
+        xml_base = rewrite_path[:split_index]
+        groups.setdefault(xml_base, []).append(
+            (start_string, rewrite_path[split_index:]))
+
+    root = construct_catalog_xml(
+        base_path=os.path.dirname(os.path.abspath(output_path))).getroot()
+    for xml_base, rewrite_rules in groups.items():
+        group_element = ET.SubElement(root, 'group')
+        group_element.attrib[xml_ns('base')] = xml_base
+        for start_string, rewrite_prefix in rewrite_rules:
+            rewrite_element = ET.SubElement(group_element, 'rewriteURI')
+            rewrite_element.attrib['uriStartString'] = start_string
+            rewrite_element.attrib['rewritePrefix'] = rewrite_prefix
+
+    catalog = ET.ElementTree(root)
+    catalog.write(output_path, pretty_print=True, xml_declaration=True,
+                  encoding='UTF-8', doctype=CATALOG_DOCTYPE)
+    add_counts(elements=1 + len(groups) + sum(
+        len(rewrite_rules) for rewrite_rules in groups.values()))
+    return catalog
+
+
+def _parse_absolute_schema_uris(base_path, catalog_relpath,
+                                max_workers=None):
+    """Parse the schema URIs of a catalog like parse_catalog_schema_uris,
+    but resolve the relative rewritePrefixes against the locations of
+    their catalog files.
+
+    :param base_path: The base path of the catalog file location
+    :param catalog_relpath: The relative path to the catalog file from
+                            the base_path
+    :param max_workers: Number of threads used for reading the catalog files
+    :returns: A dictionary of schema URIs with uriStartStrings and absolute
+              rewritePrefixes
+    """
+    schema_uris = {}
+    for catalog_path, rewrite_uris in _walk_catalogs(
+            base_path, catalog_relpath, max_workers=max_workers):
+        catalog_dir = os.path.dirname(os.path.abspath(catalog_path))
+        for start_string, rewrite_path in rewrite_uris:
+            schema_uris[start_string] = _absolute_rewrite_path(catalog_dir,
+                                                               rewrite_path)
+    return schema_uris
+
+
+def _absolute_rewrite_path(catalog_dir, rewrite_path):
+    """Resolve a relative rewritePrefix against the directory of its
+    catalog file. URIs and absolute paths are returned unchanged.
+
+    :param catalog_dir: Absolute path to the directory of the catalog file
+    :param rewrite_path: The rewritePrefix, including xml:base
+    :returns: Absolute rewritePrefix
+    """
+    if os.path.isabs(rewrite_path) or urlsplit(rewrite_path).scheme:
+        return rewrite_path
+
+    absolute_path = os.path.normpath(os.path.join(catalog_dir, rewrite_path))
+    if rewrite_path.endswith('/'):
+        absolute_path += '/'
+    return absolute_path
+
+
+@instrumented('parse_catalog_schema_uris')
+def parse_catalog_schema_uris(base_path, catalog_relpath, schema_uris=None,
+                              use_cache=True, max_workers=None):
     """Parses the schema URIs from a given schema catalog file and its
     related additional catalog entry files specified in the nextCatalog
     elements of each catalog file that is read.
 
+    The nextCatalog chain is walked iteratively in depth-first order, so
+    the entries of later catalog files override the earlier ones. A catalog
+    file linked from several catalog files is parsed only once, but its
+    entries are merged again each time it is reached. Catalog files linking
+    back to themselves are reported with a warning and skipped.
+
+    The entries of each catalog file are cached in CATALOG_CACHE, keyed by
+    the resolved path of the file and its modification time, size and inode,
+    so only the catalog files changed since the previous call are parsed
+    again.
+
     :param base_path: The base path of the catalog file location
     :param catalog_relpath: The relative path to the catalog file from
                             the base_path
+    :param use_cache: Whether to use the process-wide catalog cache
+    :param max_workers: Number of threads used for reading the catalog
+                        files linked to each catalog in parallel. By
+                        default the catalog files are read one at a time.
+                        The result does not depend on the number of threads.
     :returns: A dictionary of schema URIs with uriStartStrings and
               rewritePrefixes (including xml:base)
     """
-    namespaces = {
-        'catalog': 'urn:oasis:names:tc:entity:xmlns:xml:catalog',
-        'xml': 'http://www.w3.org/XML/1998/namespace'
-    }
-    root = ET.parse(os.path.join(base_path, catalog_relpath)).getroot()
-
     if not schema_uris:
         schema_uris = {}
-    for rewrite_uri in root.xpath('//catalog:rewriteURI',
-                                  namespaces=namespaces):
 
-        # Add the xml:base value to the rewritePrefix path if it exists,
-        # use the closest found value, starting from the current node
-        try:
-            xml_base = rewrite_uri.xpath(
-                './ancestor-or-self::*/@xml:base', namespaces=namespaces)[-1]
-        except IndexError:
-            xml_base = ''
-
-        rewrite_path = os.path.join(xml_base, rewrite_uri.get('rewritePrefix'))
-        schema_uris[rewrite_uri.get('uriStartString')] = rewrite_path
-
-    # Parse all additional catalog entry files as well, including additional
-    # catalog entries listed in the subsequent catalog files that are parsed
-    for next_catalog in root.xpath('//catalog:nextCatalog',
-                                   namespaces=namespaces):
-        next_catalog_relpath = next_catalog.get('catalog')
-        schema_uris = parse_catalog_schema_uris(
-            base_path=os.path.dirname(os.path.join(base_path,
-                                                   next_catalog_relpath)),
-            catalog_relpath=os.path.basename(next_catalog_relpath),
-            schema_uris=schema_uris)
+    for _, rewrite_uris in _walk_catalogs(base_path, catalog_relpath,
+                                          use_cache, max_workers):
+        schema_uris.update(rewrite_uris)
 
     return schema_uris
+
+
+def save_catalog_snapshot(snapshot_path, base_path, catalog_relpath,
+                          max_workers=None):
+    """Parse the schema URIs of a catalog and save them to a snapshot file.
+
+    The snapshot is a compact JSON file containing the merged schema URIs
+    and the paths, modification times and sizes of the catalog files they
+    were read from. The snapshot file is replaced atomically, so it can be
+    shared between concurrently running processes.
+
+    :param snapshot_path: Path to the snapshot file
+    :param base_path: The base path of the catalog file location
+    :param catalog_relpath: The relative path to the catalog file from
+                            the base_path
+    :param max_workers: Number of threads used for reading the catalog
+                        files, see parse_catalog_schema_uris
+    :returns: A dictionary of schema URIs with uriStartStrings and
+              rewritePrefixes (including xml:base)
+    """
+    schema_uris = {}
+    sources = {}
+    for catalog_path, rewrite_uris in _walk_catalogs(
+            base_path, catalog_relpath, max_workers=max_workers):
+        source_path = os.path.abspath(catalog_path)
+        if source_path not in sources:
+            stat = os.stat(catalog_path)
+            sources[source_path] = [source_path, stat.st_mtime_ns,
+                                    stat.st_size]
+        schema_uris.update(rewrite_uris)
+
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'catalog': os.path.abspath(os.path.join(base_path, catalog_relpath)),
+        'sources': list(sources.values()),
+        'schema_uris': schema_uris
+    }
+    with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', delete=False,
+            dir=os.path.dirname(os.path.abspath(snapshot_path)),
+            prefix='.catalog-snapshot-') as snapshot_file:
+        json.dump(snapshot, snapshot_file, separators=(',', ':'))
+    os.replace(snapshot_file.name, snapshot_path)
+
+    return schema_uris
+
+
+def load_catalog_snapshot(snapshot_path, base_path, catalog_relpath,
+                          max_workers=None):
+    """Load the schema URIs of a catalog from a snapshot file.
+
+    The catalog files are not parsed if the snapshot is up to date. If the
+    snapshot does not exist, was saved for another catalog, or any of the
+    catalog files it was read from has been changed or removed, the catalog
+    is parsed again and the snapshot is rebuilt.
+
+    :param snapshot_path: Path to the snapshot file
+    :param base_path: The base path of the catalog file location
+    :param catalog_relpath: The relative path to the catalog file from
+                            the base_path
+    :param max_workers: Number of threads used for reading the catalog
+                        files when the snapshot is rebuilt
+    :returns: A dictionary of schema URIs with uriStartStrings and
+              rewritePrefixes (including xml:base)
+    """
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        snapshot = None
+
+    if snapshot is not None and _is_snapshot_current(
+            snapshot, os.path.join(base_path, catalog_relpath)):
+        return snapshot['schema_uris']
+
+    return save_catalog_snapshot(snapshot_path, base_path, catalog_relpath,
+                                 max_workers=max_workers)
+
+
+def _is_snapshot_current(snapshot, catalog_path):
+    """Check that the snapshot was saved for the given catalog and that
+    none of its source catalog files has changed since.
+
+    :param snapshot: Loaded snapshot
+    :param catalog_path: Path to the root catalog file
+    :returns: True if the snapshot is up to date, otherwise False
+    """
+    if snapshot.get('version') != SNAPSHOT_VERSION or \
+            snapshot.get('catalog') != os.path.abspath(catalog_path):
+        return False
+
+    for source_path, mtime_ns, size in snapshot['sources']:
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size):
+            return False
+
+    return True
+
+
+def _walk_catalogs(base_path, catalog_relpath, use_cache=True,
+                   max_workers=None):
+    """Walk through a catalog file and the catalog files linked to it in
+    its nextCatalog elements.
+
+    Each catalog file is parsed only once, but it is yielded each time it
+    is reached in depth-first order, see parse_catalog_schema_uris.
+
+    If *max_workers* is given, the catalog files linked to each visited
+    catalog are read ahead in a thread pool, while the catalogs are still
+    yielded in the same order as without the thread pool.
+
+    :param base_path: The base path of the catalog file location
+    :param catalog_relpath: The relative path to the catalog file from
+                            the base_path
+    :param use_cache: Whether to use the process-wide catalog cache
+    :param max_workers: Number of threads used for reading the catalogs
+    :yields: Tuples of the catalog file path and its rewriteURI entries,
+             in the order the entries are to be merged
+    """
+    executor = None
+    if max_workers is not None and max_workers > 1:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    # Catalog files being read ahead, keyed by their resolved paths
+    pending = {}
+
+    # Entries of the catalog files already read, keyed by their resolved
+    # paths
+    loaded = {}
+    # The stack contains the catalog files to visit as (base_path,
+    # catalog_path, realpath, chain) tuples, where chain is the catalogs
+    # linking to the catalog.
+    catalog_path = os.path.join(base_path, catalog_relpath)
+    stack = [(base_path, catalog_path, os.path.realpath(catalog_path), ())]
+    try:
+        while stack:
+            base_path, catalog_path, realpath, chain = stack.pop()
+
+            if realpath in chain:
+                warnings.warn(
+                    f"Catalog cycle detected: {catalog_path} links back to "
+                    f"itself through {' -> '.join(chain)}")
+                continue
+            entries = loaded.get(realpath)
+            if entries is None:
+                if realpath in pending:
+                    entries = pending.pop(realpath).result()
+                else:
+                    entries = _load_catalog(catalog_path, realpath, use_cache)
+                loaded[realpath] = entries
+                if is_enabled():
+                    add_counts(size=source_size(catalog_path),
+                               elements=len(entries[0]) + len(entries[1]))
+            rewrite_uris, next_catalogs = entries
+            yield catalog_path, rewrite_uris
+
+            # Push the nextCatalogs in reverse order, so that they are
+            # visited in document order
+            chain += (realpath,)
+            for next_catalog_relpath in reversed(next_catalogs):
+                next_base_path = os.path.dirname(
+                    os.path.join(base_path, next_catalog_relpath))
+                next_catalog_path = os.path.join(
+                    next_base_path, os.path.basename(next_catalog_relpath))
+                next_realpath = os.path.realpath(next_catalog_path)
+                stack.append((next_base_path, next_catalog_path,
+                              next_realpath, chain))
+
+                if executor is not None and next_realpath not in loaded \
+                        and next_realpath not in pending:
+                    pending[next_realpath] = executor.submit(
+                        _load_catalog, next_catalog_path, next_realpath,
+                        use_cache)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _load_catalog(catalog_path, realpath, use_cache=True):
+    """Read the entries of a single catalog file, using CATALOG_CACHE if
+    requested.
+
+    :param catalog_path: Path to the catalog file
+    :param realpath: Resolved path to the catalog file
+    :param use_cache: Whether to use the process-wide catalog cache
+    :returns: Tuple of the rewriteURI entries as (uriStartString,
+              rewritePrefix) pairs and the nextCatalog paths
+    """
+    if not use_cache:
+        return _read_catalog(catalog_path)
+
+    stat = os.stat(catalog_path)
+    key = (realpath, stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    entries = CATALOG_CACHE.get(key)
+    if entries is None:
+        entries = _read_catalog(catalog_path)
+        CATALOG_CACHE.put(key, entries)
+    return entries
+
+
+def _read_catalog(catalog_path):
+    """Parse the entries of a single catalog file.
+
+    The xml:base values are inherited while walking down the tree, so
+    that the closest xml:base value, starting from the rewriteURI element
+    itself, is added to each rewritePrefix.
+
+    :param catalog_path: Path to the catalog file
+    :returns: Tuple of the rewriteURI entries as (uriStartString,
+              rewritePrefix) pairs and the nextCatalog paths
+    """
+    root = ET.parse(catalog_path).getroot()
+
+    rewrite_uris = []
+    next_catalogs = []
+    stack = [(root, '')]
+    while stack:
+        element, xml_base = stack.pop()
+        xml_base = element.get(XML_BASE, xml_base)
+
+        if element.tag == REWRITE_URI:
+            rewrite_path = os.path.join(xml_base, element.get('rewritePrefix'))
+            rewrite_uris.append((element.get('uriStartString'), rewrite_path))
+        elif element.tag == NEXT_CATALOG:
+            next_catalogs.append(element.get('catalog'))
+
+        stack.extend((child, xml_base) for child in reversed(element)
+                     if isinstance(child.tag, str))
+
+    return tuple(rewrite_uris), tuple(next_catalogs)
+
+
+class CatalogResolver:
+    """Resolve URIs with the rewrite rules of a parsed catalog.
+
+    The rewrite rules are kept in a dictionary keyed by their
+    uriStartStrings, together with the distinct lengths of the
+    uriStartStrings. Resolving a URI looks up its prefixes of those lengths
+    only, longest first, so it takes at most one dictionary lookup per
+    distinct length and does not depend on the number of rewrite rules. As
+    specified by the OASIS XML Catalogs standard, the rule with the longest
+    matching uriStartString is used.
+    """
+
+    def __init__(self, schema_uris):
+        """Index the rewrite rules.
+
+        :param schema_uris: A dictionary of uriStartStrings and
+            rewritePrefixes, as returned by parse_catalog_schema_uris
+        """
+        self._rules = dict(schema_uris)
+        self._lengths = sorted({len(start_string)
+                                for start_string in self._rules},
+                               reverse=True)
+
+    @classmethod
+    def from_catalog(cls, base_path, catalog_relpath):
+        """Build a resolver from a catalog file and the catalog files it
+        links to.
+
+        :param base_path: The base path of the catalog file location
+        :param catalog_relpath: The relative path to the catalog file from
+                                the base_path
+        :returns: CatalogResolver instance
+        """
+        return cls(parse_catalog_schema_uris(base_path, catalog_relpath))
+
+    def resolve(self, uri):
+        """Rewrite the given URI with the longest matching rewrite rule.
+
+        :param uri: URI to resolve
+        :returns: The rewritten URI, or None if no rewrite rule matches
+        """
+        rules = self._rules
+        uri_length = len(uri)
+        for length in self._lengths:
+            if length <= uri_length:
+                rewrite_prefix = rules.get(uri[:length])
+                if rewrite_prefix is not None:
+                    return rewrite_prefix + uri[length:]
+        return None
+
+    def resolve_many(self, uris):
+        """Rewrite the given URIs with the longest matching rewrite rules.
+
+        :param uris: Iterable of URIs to resolve
+        :returns: List of the rewritten URIs, containing None for each URI
+                  that no rewrite rule matches
+        """
+        return [self.resolve(uri) for uri in uris]
+
+
+class CatalogSchemaResolver(ET.Resolver):
+    """lxml resolver that rewrites URLs with the rewrite rules of a catalog
+    and serves the schema files from memory.
+
+    The contents of the schema files are cached in SCHEMA_FILE_CACHE, which
+    is shared by all the resolvers in the process, so schemas imported by
+    many other schemas are read from disk only once. The cached contents
+    are invalidated when the modification time or size of a file changes.
+
+    Usage::
+
+        parser = ET.XMLParser()
+        parser.resolvers.add(CatalogSchemaResolver.from_catalog(
+            base_path, catalog_relpath))
+        schema = ET.XMLSchema(ET.parse(schema_path, parser))
+
+    URLs that are not rewritten to local files are left for libxml2 to
+    resolve.
+    """
+
+    def __init__(self, schema_uris=None):
+        """Initialize the resolver.
+
+        :param schema_uris: A dictionary of uriStartStrings and
+            rewritePrefixes, as returned by parse_catalog_schema_uris
+        """
+        super().__init__()
+        self._catalog_resolver = CatalogResolver(schema_uris or {})
+
+    @classmethod
+    def from_catalog(cls, base_path, catalog_relpath, max_workers=None):
+        """Build a resolver from a catalog file and the catalog files it
+        links to. Relative rewritePrefixes are resolved against the
+        locations of their catalog files.
+
+        :param base_path: The base path of the catalog file location
+        :param catalog_relpath: The relative path to the catalog file from
+                                the base_path
+        :param max_workers: Number of threads used for reading the catalog
+                            files, see parse_catalog_schema_uris
+        :returns: CatalogSchemaResolver instance
+        """
+        return cls(_parse_absolute_schema_uris(base_path, catalog_relpath,
+                                               max_workers))
+
+    def resolve(self, system_url, public_id, context):
+        """Resolve the URL to a local file and serve its contents from
+        SCHEMA_FILE_CACHE.
+
+        :param system_url: URL to resolve
+        :param public_id: Public identifier, not used
+        :param context: Resolver context given by lxml
+        :returns: Resolved input for lxml, or None if the URL can not be
+                  resolved to a local file
+        """
+        url = self._catalog_resolver.resolve(system_url) or system_url
+        url_parts = urlsplit(url)
+        if url_parts.scheme == 'file':
+            path = url2pathname(url_parts.path)
+        elif not url_parts.scheme:
+            path = url
+        else:
+            return None
+
+        content = _read_schema_file(path)
+        if content is None:
+            return None
+        return self.resolve_string(content, context, base_url=path)
+
+
+def _read_schema_file(path):
+    """Read the contents of a schema file through SCHEMA_FILE_CACHE.
+
+    :param path: Path to the schema file
+    :returns: The contents of the file as a byte string, or None if the
+              file can not be read
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+    content = SCHEMA_FILE_CACHE.get(key)
+    if content is None:
+        try:
+            with open(path, 'rb') as schema_file:
+                content = schema_file.read()
+        except OSError:
+            return None
+        SCHEMA_FILE_CACHE.put(key, content)
+    return content
@@ -2,20 +2,237 @@
 structures
 """
 
+import bisect
+import codecs
+import copy
 import datetime
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import pickle
+import re
+import sys
+import threading
+from array import array
+from collections import deque, namedtuple
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                as_completed, wait)
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape, quoteattr
 
 import lxml.etree as ET
 
+from xml_helpers.cache import LRUCache
+from xml_helpers.instrumentation import (add_counts, element_count,
+                                         instrumented, instrumented_iterator,
+                                         source_size)
+
 XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
 XML_NS = 'http://www.w3.org/XML/1998/namespace'
 
+XML_DECLARATION_ENCODING = re.compile(
+    rb'(?:\xef\xbb\xbf)?<\?xml[^>]*?\sencoding\s*=\s*'
+    rb'["\']([A-Za-z][\w.-]*)["\']')
+
+# Encoding declaration in a decoded XML declaration, rewritten by UTF8Reader
+XML_DECLARATION_ENCODING_TEXT = re.compile(
+    r'(<\?xml[^>]*?\sencoding\s*=\s*)(["\'])[A-Za-z][\w.-]*\2')
+
+# Byte order marks and the first characters of XML documents in the
+# encodings detected by UTF8Reader, see appendix F of the XML specification.
+# UTF-32 is checked before UTF-16, as their little endian byte order marks
+# start the same way.
+ENCODING_SIGNATURES = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+    (b'\x00\x00\x00<', 'utf-32-be'),
+    (b'<\x00\x00\x00', 'utf-32-le'),
+    (b'\x00<\x00?', 'utf-16-be'),
+    (b'<\x00?\x00', 'utf-16-le'),
+)
+
+# Parsers of readfile, reused within each thread
+_PARSER_POOL = threading.local()
+
+# Process-wide cache of the trees read by readfile. The size of the cache
+# is limited to 256 MiB of approximate memory use of the trees by default,
+# and it can be changed by setting READFILE_CACHE.maxsize.
+READFILE_CACHE = LRUCache(maxsize=256 * 1024 * 1024,
+                          weigher=lambda entry: entry[1])
+
+# Approximate memory used by a node of a parsed tree in bytes, and the
+# node counts used for estimating the memory used by a tree. The nodes and
+# the attributes are counted separately, as counting their union takes
+# super-linear time in libxml2.
+NODE_SIZE = 120
+_COUNT_NODES = ET.XPath('count(//node())')
+_COUNT_ATTRIBUTES = ET.XPath('count(//@*)')
+
+# Suffix and format version of the index files written by build_index
+INDEX_SUFFIX = '.index'
+INDEX_VERSION = 2
+
+# Record of an element yielded by iter_records. The depth of the root
+# element is 0.
+ElementRecord = namedtuple('ElementRecord', ['tag', 'attrib', 'text', 'depth'])
+
+# Result of a file processed by map_files. Either the result or the error
+# message is None.
+FileResult = namedtuple('FileResult', ['path', 'result', 'error'])
+
+# Position of CheckpointedIterator in the XML file. The ancestors are the
+# start tags of the open ancestor elements followed by their texts, and the
+# encoding is the encoding of the file.
+Checkpoint = namedtuple('Checkpoint', ['offset', 'ancestors', 'encoding'])
+
 
-def readfile(filename):
-    """Read file, remove blanks and comments"""
-    xmlparser = ET.XMLParser(remove_blank_text=True, remove_comments=True)
-    return ET.parse(filename, parser=xmlparser)
+@instrumented('readfile', lambda tree, filename, *args, **kwargs: (
+    source_size(filename), element_count(tree)))
+def readfile(filename, huge_tree=False, resolve_entities=None,
+             no_network=True, recover=False, cache=False):
+    """Read file, remove blanks and comments
 
+    The parsers are reused between the calls in the same thread, one parser
+    for each combination of the options.
+
+    With cache enabled, the parsed trees are kept in READFILE_CACHE, keyed
+    by the path, modification time and size of the file, and the parser
+    options. A copy of the cached tree is returned, so modifying it does
+    not affect the cached tree.
+
+    :filename: Filename, file-like object, or the XML data as bytes,
+               bytearray, memoryview or mmap object
+    :huge_tree: Disable the security restrictions of libxml2 and allow
+                reading very deep trees and very long texts
+    :resolve_entities: Whether to replace entities with their values,
+                       None keeps the default of lxml
+    :no_network: Prevent network access when looking up external documents
+    :recover: Try hard to parse through broken XML
+    :cache: Whether to use READFILE_CACHE when reading a file by its path
+    :returns: ElementTree-object
+
+    """
+    options = (huge_tree, resolve_entities, no_network, recover)
+    xmlparser = _get_parser(options)
+
+    if isinstance(filename, (bytes, bytearray, memoryview, mmap.mmap)):
+        return ET.fromstring(filename, parser=xmlparser).getroottree()
+    if not cache or not isinstance(filename, (str, os.PathLike)):
+        return ET.parse(filename, parser=xmlparser)
+
+    stat = os.stat(filename)
+    key = (os.path.realpath(filename), stat.st_mtime_ns, stat.st_size,
+           options)
+    entry = READFILE_CACHE.get(key)
+    if entry is None:
+        tree = ET.parse(filename, parser=xmlparser)
+        entry = (tree, _approximate_tree_size(tree, stat.st_size))
+        READFILE_CACHE.put(key, entry)
+    return copy.deepcopy(entry[0])
+
+
+def _get_parser(options):
+    """Return the parser of readfile for the options, reusing the parsers
+    within each thread.
+
+    :options: Tuple of huge_tree, resolve_entities, no_network and recover
+    :returns: XMLParser
+    """
+    try:
+        parsers = _PARSER_POOL.parsers
+    except AttributeError:
+        parsers = _PARSER_POOL.parsers = {}
 
+    xmlparser = parsers.get(options)
+    if xmlparser is None:
+        huge_tree, resolve_entities, no_network, recover = options
+        parser_options = {}
+        if resolve_entities is not None:
+            parser_options['resolve_entities'] = resolve_entities
+        xmlparser = ET.XMLParser(
+            remove_blank_text=True, remove_comments=True,
+            huge_tree=huge_tree, no_network=no_network, recover=recover,
+            **parser_options)
+        parsers[options] = xmlparser
+    return xmlparser
+
+
+def _approximate_tree_size(tree, file_size):
+    """Approximate the memory used by a parsed tree.
+
+    :tree: ElementTree-object
+    :file_size: Size of the parsed file in bytes
+    :returns: Approximate size in bytes
+    """
+    node_count = _COUNT_NODES(tree) + _COUNT_ATTRIBUTES(tree)
+    return file_size + int(node_count) * NODE_SIZE
+
+
+def readfile_partial(source, tag=None, path=None, namespaces=None,
+                     huge_tree=False):
+    """Read only the selected elements of a file, remove blanks and
+    comments.
+
+    The file is parsed with iterparse, and only the elements matching the
+    given tag or path are kept with their child trees, together with their
+    ancestors up to the root element. Everything else is removed from the
+    tree as soon as it has been parsed, so the memory usage is bounded by
+    the size of the selected elements. The tags and paths are matched like
+    in iter_elements.
+
+    :source: Filename or file-like object
+    :tag: Tag or list of tags of the elements to keep
+    :path: Path of the elements to keep
+    :namespaces: Dictionary of namespace prefixes used in tag and path
+    :huge_tree: Disable the security restrictions of libxml2 and allow
+                reading very deep trees and very long texts
+    :returns: ElementTree-object containing the root element, the selected
+              elements and their ancestors
+
+    """
+    if tag is None and path is None:
+        raise ValueError("Either tag or path must be given")
+    tags, steps, absolute = _parse_filter(tag, path, namespaces)
+
+    # For each open element, whether it is kept because it contains
+    # selected elements
+    contains_selected = []
+    selected_depth = 0
+    root = None
+    for event, element in ET.iterparse(source, events=('start', 'end'),
+                                       remove_blank_text=True,
+                                       remove_comments=True,
+                                       huge_tree=huge_tree):
+        if event == 'start':
+            if selected_depth or (
+                    element.tag in tags and (
+                        steps is None or
+                        _path_matches(element, steps, absolute))):
+                selected_depth += 1
+            contains_selected.append(False)
+            continue
+
+        keep = contains_selected.pop()
+        if selected_depth:
+            selected_depth -= 1
+            keep = True
+        if not contains_selected:
+            root = element
+        elif keep:
+            contains_selected[-1] = True
+        else:
+            element.getparent().remove(element)
+
+    return root.getroottree()
+
+
+@instrumented('serialize', lambda result, root_element: (
+    len(result), element_count(root_element)))
 def serialize(root_element):
     """Serialize lxml.etree structure.
 
@@ -30,6 +247,30 @@ def serialize(root_element):
     )
 
 
+def serialize_to(root_element, destination):
+    """Serialize lxml.etree structure directly to a file.
+
+    The output is identical to the output of serialize, but it is written
+    incrementally, so the serialized document is never held in memory as a
+    whole.
+
+    :root_element: Starting element or element tree to serialize
+    :destination: Path or binary file-like object to write to
+
+    """
+    ET.cleanup_namespaces(root_element)
+    if hasattr(root_element, 'getroot'):
+        # The root element of a tree is serialized with its siblings, such
+        # as comments and processing instructions, as in ET.tostring
+        root_element.write(destination, pretty_print=True,
+                           xml_declaration=True, encoding='UTF-8')
+        return
+
+    with ET.xmlfile(destination, encoding='UTF-8') as xml_file:
+        xml_file.write_declaration()
+        xml_file.write(root_element, pretty_print=True)
+
+
 def get_namespace(elem):
     """return xml element's namespace"""
     return elem.nsmap[elem.prefix]
@@ -65,6 +306,7 @@ def xml_ns(tag):
     return f'{{{XML_NS}}}{tag}'
 
 
+@instrumented('compare_trees')
 def compare_trees(tree1, tree2):
     """Compare two XML trees with ignoring whitespaces
 
@@ -72,26 +314,300 @@ def compare_trees(tree1, tree2):
     :tree2: Root element of lxml.etree
     :returns: True if trees match, otherwise False
     """
-    if set(tree1.attrib.keys()) != set(tree2.attrib.keys()) or (
-            len(tree1) != len(tree2)):
-        return False
+    equal, visited = _compare_subtrees(tree1, tree2)
+    add_counts(elements=2 * visited)
+    return equal
+
+
+def _compare_subtrees(tree1, tree2):
+    """Compare two XML trees, see compare_trees.
+
+    :tree1: Root element of lxml.etree
+    :tree2: Root element of lxml.etree
+    :returns: Tuple of True if the trees match, otherwise False, and the
+              number of element pairs compared
+    """
+    visited = 1
+    if not _elements_equal(tree1, tree2):
+        return False, visited
+
+    # The stack contains iterators over the child pairs of the open
+    # elements, so that the comparison stops at the first difference
+    # without collecting the children of each level first
+    stack = [zip(tree1, tree2)]
+    while stack:
+        pair = next(stack[-1], None)
+        if pair is None:
+            stack.pop()
+            continue
+
+        elem1, elem2 = pair
+        visited += 1
+        if not _elements_equal(elem1, elem2):
+            return False, visited
+        stack.append(zip(elem1, elem2))
+
+    return True, visited
+
+
+def _elements_equal(elem1, elem2):
+    """Compare two elements without their children, ignoring whitespace.
+
+    :elem1: Element of lxml.etree
+    :elem2: Element of lxml.etree
+    :returns: True if the elements match, otherwise False
+    """
+    # Tags can not contain whitespace, so they are compared as such
+    return elem1.tag == elem2.tag and len(elem1) == len(elem2) and \
+        _attributes_equal(elem1.attrib, elem2.attrib) and \
+        _stripped_equal(elem1.text, elem2.text) and \
+        _stripped_equal(elem1.tail, elem2.tail)
+
+
+def compare_files(path1, path2):
+    """Compare two XML files with ignoring whitespaces, and find the first
+    difference.
+
+    The files are compared like compare_trees compares the trees read from
+    the files with readfile, but both files are streamed in lockstep, and
+    the elements are removed from the trees as soon as they have been
+    compared. The memory usage thus depends only on the depth of the
+    documents, and the comparison stops at the first difference.
+
+    :path1: Filename or file-like object
+    :path2: Filename or file-like object
+    :returns: None if the files match, otherwise the path of the first
+              differing element, such as ``/root[1]/child[2]``
+    """
+    parse_options = {'events': ('start', 'end', 'pi'),
+                     'remove_blank_text': True,
+                     'remove_comments': True}
+    stack = []
+    for item1, item2 in itertools.zip_longest(
+            _content_events(ET.iterparse(path1, **parse_options)),
+            _content_events(ET.iterparse(path2, **parse_options))):
+        parent = stack[-1] if stack else None
+
+        if item1 is None or item2 is None or item1[0] != item2[0]:
+            return parent.path if parent else '/'
+        event, elem1 = item1
+        elem2 = item2[1]
+
+        if parent is not None:
+            difference = parent.compare_text() or parent.compare_last()
+            if difference:
+                return difference
+
+        if event == 'end':
+            stack.pop()
+            if parent.parent is not None:
+                parent.parent.last = (elem1, elem2, parent.path)
+            continue
+
+        if elem1.tag != elem2.tag:
+            return parent.step_path(elem1) if parent else '/'
+
+        if event == 'pi':
+            path = parent.step_path(elem1)
+            if not _stripped_equal(elem1.text, elem2.text):
+                return path
+            parent.last = (elem1, elem2, path)
+            continue
+
+        path = parent.step_path(elem1) if parent else f'/{elem1.tag}[1]'
+        if not _attributes_equal(elem1.attrib, elem2.attrib):
+            return path
+        stack.append(_ComparedElements(elem1, elem2, path, parent))
+
+    return None
+
+
+def fingerprint(tree):
+    """Return a structural fingerprint of an XML tree.
+
+    The fingerprint is a SHA-256 digest computed with the same
+    normalization as compare_trees uses: the whitespace around texts,
+    tails and attribute values is stripped, and the order of the
+    attributes is ignored. Trees with equal fingerprints are thus equal
+    according to compare_trees, and vice versa.
+
+    :tree: Root element or element tree of lxml.etree
+    :returns: Fingerprint as a hexadecimal string
+    """
+    digest = None
+    for _, digest in iter_fingerprints(tree):
+        pass
+    return digest
+
+
+def iter_fingerprints(tree):
+    """Compute the fingerprints of all subtrees of an XML tree in one pass.
+
+    The fingerprint of each element is computed from its own content and
+    the fingerprints of its children, so the fingerprints of the subtrees
+    can be used e.g. for grouping equal subtrees. See fingerprint.
+
+    :tree: Root element or element tree of lxml.etree
+    :yields: (element, fingerprint) tuples, children before their parents
+    """
+    if hasattr(tree, 'getroot'):
+        tree = tree.getroot()
+
+    # The stack contains the open elements with an iterator over their
+    # children and the digests of the children handled so far
+    stack = [(tree, iter(tree), [])]
+    while stack:
+        element, children, child_digests = stack[-1]
+        child = next(children, None)
+        if child is not None:
+            stack.append((child, iter(child), []))
+            continue
+
+        stack.pop()
+        digest = _element_digest(element, child_digests)
+        if stack:
+            stack[-1][2].append(digest)
+        yield element, digest.hex()
+
+
+def _element_digest(element, child_digests):
+    """Compute the digest of an element from its normalized content and the
+    digests of its children.
+
+    :element: Element
+    :child_digests: Digests of the children as byte strings
+    :returns: Digest as byte string
+    """
+    hasher = hashlib.sha256()
+    tag = element.tag
+    if isinstance(tag, str):
+        hasher.update(b'E')
+        _hash_string(hasher, tag)
+    else:
+        # Comments and processing instructions have factory functions as
+        # their tags
+        hasher.update(b'N')
+        _hash_string(hasher, tag.__name__)
+
+    for text in (element.text, element.tail):
+        _hash_string(hasher, text.strip() if text is not None else None)
+
+    attributes = sorted(element.attrib.items())
+    hasher.update(len(attributes).to_bytes(8, 'big'))
+    for key, value in attributes:
+        _hash_string(hasher, key)
+        _hash_string(hasher, value.strip())
+
+    hasher.update(len(child_digests).to_bytes(8, 'big'))
+    for child_digest in child_digests:
+        hasher.update(child_digest)
+    return hasher.digest()
+
+
+def _hash_string(hasher, value):
+    """Feed a string or None to the hasher unambiguously."""
+    if value is None:
+        hasher.update(b'\x00')
+        return
+    data = value.encode('utf-8')
+    hasher.update(b'\x01' + len(data).to_bytes(8, 'big'))
+    hasher.update(data)
 
-    for attr in ('tag', 'text', 'tail'):
-        attr1_val = getattr(tree1, attr)
-        attr2_val = getattr(tree2, attr)
-        try:
-            if attr1_val.strip() != attr2_val.strip():
-                return False
-        except AttributeError:
-            # AttributeError takes place if None value is being stripped.
-            if attr1_val != attr2_val:
-                return False
-
-    for attr_key, attr_value in tree1.attrib.iteritems():
-        if attr_value.strip() != tree2.attrib[attr_key].strip():
-            return False
 
-    return all(compare_trees(c1, c2) for c1, c2 in zip(tree1, tree2))
+class _ComparedElements:
+    """State of a pair of open elements compared by compare_files."""
+
+    def __init__(self, elem1, elem2, path, parent):
+        self.elem1 = elem1
+        self.elem2 = elem2
+        self.path = path
+        self.parent = parent
+        # Last compared child elements and their path, waiting for their
+        # tails to be compared
+        self.last = None
+        self.text_compared = False
+        self.tag_counts = {}
+
+    def step_path(self, child):
+        """Return the path of the next child element."""
+        name = child.tag
+        if not isinstance(name, str):
+            name = 'processing-instruction()'
+        count = self.tag_counts[name] = self.tag_counts.get(name, 0) + 1
+        return f'{self.path}/{name}[{count}]'
+
+    def compare_text(self):
+        """Compare the texts of the elements, once they have been parsed
+        completely, i.e. at the start of the first child or at the end of
+        the elements.
+
+        :returns: Path of the elements if the texts differ, otherwise None
+        """
+        if self.text_compared:
+            return None
+        self.text_compared = True
+        if _stripped_equal(self.elem1.text, self.elem2.text):
+            return None
+        return self.path
+
+    def compare_last(self):
+        """Compare the tails of the last child elements, once they have
+        been parsed completely, and remove the child elements.
+
+        :returns: Path of the child elements if the tails differ,
+                  otherwise None
+        """
+        if self.last is None:
+            return None
+        last1, last2, path = self.last
+        self.last = None
+        if not _stripped_equal(last1.tail, last2.tail):
+            return path
+        self.elem1.remove(last1)
+        self.elem2.remove(last2)
+        return None
+
+
+def _content_events(events):
+    """Filter out the processing instruction events outside the root
+    element, which compare_trees does not compare.
+
+    :events: Iterable of (event, element) tuples
+    :yields: (event, element) tuples
+    """
+    depth = 0
+    for event, element in events:
+        if event == 'start':
+            depth += 1
+        elif event == 'end':
+            depth -= 1
+        elif depth == 0:
+            continue
+        yield event, element
+
+
+def _stripped_equal(value1, value2):
+    """Compare two values, stripping the whitespace around strings. None
+    is not equal to any string.
+    """
+    try:
+        return value1.strip() == value2.strip()
+    except AttributeError:
+        # AttributeError takes place if None value is being stripped.
+        return value1 == value2
+
+
+def _attributes_equal(attrib1, attrib2):
+    """Compare the names and the stripped values of two sets of
+    attributes.
+    """
+    if len(attrib1) != len(attrib2):
+        return False
+    for key, value in attrib1.items():
+        value2 = attrib2.get(key)
+        if value2 is None or value.strip() != value2.strip():
+            return False
+    return True
 
 
 def decode_utf8(text):
@@ -142,7 +658,143 @@ def ensure_text(text, encoding='utf-8', errors='strict'):
     raise TypeError("not expecting type '%s'" % type(text))
 
 
-def iter_elements(source):
+class UTF8Reader:
+    """File-like reader converting XML data to UTF-8 on the fly.
+
+    The encoding of the data is detected from the byte order mark, or from
+    the first characters and the encoding declaration, and the data is
+    decoded with an incremental decoder one chunk at a time. The byte order
+    mark is dropped and the encoding declaration is rewritten as UTF-8, so
+    the reader can be given to readfile, iter_elements or any other
+    function reading XML from a file-like object. Data already in UTF-8 is
+    passed through as is.
+
+    The detected encoding of the source is available as ``encoding``.
+    """
+
+    CHUNK_SIZE = 65536
+    HEAD_SIZE = 1024
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE):
+        """Initialize the reader and detect the encoding.
+
+        :source: Filename or binary file-like object
+        :chunk_size: Number of bytes read from the source at a time
+        :raises: ValueError if the encoding is not supported
+        """
+        self._owned = not hasattr(source, 'read')
+        self._source = open(source, 'rb') if self._owned else source
+        self._chunk_size = chunk_size
+        self._eof = False
+
+        head = b''
+        while len(head) < self.HEAD_SIZE:
+            chunk = self._source.read(chunk_size)
+            if not chunk:
+                self._eof = True
+                break
+            head += chunk
+
+        self.encoding = _detect_encoding(head)
+        try:
+            codec_name = codecs.lookup(self.encoding).name
+        except LookupError as exception:
+            self.close()
+            raise ValueError(
+                f"Unsupported encoding: {self.encoding}") from exception
+
+        if codec_name in ('utf-8', 'utf-8-sig'):
+            self._decoder = None
+            if codec_name == 'utf-8-sig' and head.startswith(
+                    codecs.BOM_UTF8):
+                head = head[len(codecs.BOM_UTF8):]
+            self._buffer = head
+        else:
+            self._decoder = codecs.getincrementaldecoder(codec_name)()
+            text = self._decoder.decode(head, final=self._eof)
+            self._buffer = encode_utf8(XML_DECLARATION_ENCODING_TEXT.sub(
+                r'\1\2UTF-8\2', text, count=1))
+
+    def read(self, size=-1):
+        """Read UTF-8 encoded data.
+
+        :size: Maximum number of bytes to read, all remaining data if
+               negative
+        :returns: Data as byte string, empty at the end of the data
+        """
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._source.read(self._chunk_size)
+            self._eof = not chunk
+            if self._decoder is None:
+                self._buffer += chunk
+            else:
+                self._buffer += encode_utf8(
+                    self._decoder.decode(chunk, final=self._eof))
+
+        if size < 0 or size >= len(self._buffer):
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        """Close the source if it was opened by the reader."""
+        if self._owned:
+            self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def transcode_to_utf8(source, destination, chunk_size=UTF8Reader.CHUNK_SIZE):
+    """Convert XML data to UTF-8 one chunk at a time, see UTF8Reader.
+
+    :source: Filename or binary file-like object
+    :destination: Filename or binary file-like object
+    :chunk_size: Number of bytes read from the source at a time
+    :returns: Detected encoding of the source
+    """
+    with UTF8Reader(source, chunk_size) as reader:
+        if hasattr(destination, 'write'):
+            _copy_chunks(reader, destination, chunk_size)
+        else:
+            with open(destination, 'wb') as out_file:
+                _copy_chunks(reader, out_file, chunk_size)
+        return reader.encoding
+
+
+def _copy_chunks(reader, destination, chunk_size):
+    """Copy data from a reader to a file object one chunk at a time.
+
+    :reader: File-like object to read from
+    :destination: Binary file-like object to write to
+    :chunk_size: Number of bytes read at a time
+    """
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        destination.write(chunk)
+
+
+def _detect_encoding(head):
+    """Detect the encoding of XML data.
+
+    :head: Beginning of the XML data as byte string
+    :returns: Name of the encoding
+    """
+    for signature, encoding in ENCODING_SIGNATURES:
+        if head.startswith(signature):
+            return encoding
+    return _declared_encoding(head)
+
+
+@instrumented_iterator('iter_elements', lambda count, source, *args,
+                       **kwargs: (source_size(source), count))
+def iter_elements(source, tag=None, path=None, namespaces=None):
     """
     Iterate over all elements in given XML file object.
 
@@ -152,14 +804,81 @@ def iter_elements(source):
     are removed from tree after end tag and requires maintaining external
     references to keep in memory.
 
+    The elements can be filtered by tag or by a simple path, such as
+    ``mets:fileSec/mets:fileGrp/mets:file``, in which case iterparse
+    reports only the elements with the matching tags, and only the
+    elements matching the path are yielded. A path starting with a slash
+    is matched from the root element, otherwise the path can start at any
+    level. The matching elements are yielded with their child trees,
+    excluding the nested matching elements yielded before them. The parsed
+    content outside the elements with matching tags is removed from the
+    tree when the next element with a matching tag ends, so the memory
+    usage is bounded by the size of the matching elements and the content
+    between two of them.
+
     :source: Filename or file-like object
+    :tag: Tag or list of tags of the elements to yield
+    :path: Path of the elements to yield
+    :namespaces: Dictionary of namespace prefixes used in tag and path
     :yields: elements as lxml.ElementTree objects
 
     """
-    stack = []
+    if tag is not None or path is not None:
+        yield from _iter_matching_elements(source, tag, path, namespaces)
+        return
+
     events = ["start", "end"]
+    yield from _yield_and_remove(ET.iterparse(source, events=events), [])
+
+
+async def aiter_elements(source, chunk_size=65536):
+    """
+    Asynchronously iterate over all elements in given asynchronous byte
+    source.
 
-    for event, element in ET.iterparse(source, events=events):
+    The data is fed to an XMLPullParser as it arrives, and the elements are
+    yielded and removed from the tree like in iter_elements, so the memory
+    usage stays constant and the event loop is blocked only for parsing one
+    chunk at a time.
+
+    :source: Asynchronous iterable of byte strings, or an object with an
+             asynchronous read method, such as asyncio.StreamReader
+    :chunk_size: Size of the chunks read with the read method
+    :yields: elements as lxml.ElementTree objects
+
+    """
+    parser = ET.XMLPullParser(events=["start", "end"])
+    stack = []
+
+    if hasattr(source, 'read'):
+        while True:
+            chunk = await source.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            for element in _yield_and_remove(parser.read_events(), stack):
+                yield element
+    else:
+        async for chunk in source:
+            parser.feed(chunk)
+            for element in _yield_and_remove(parser.read_events(), stack):
+                yield element
+
+    parser.close()
+    for element in _yield_and_remove(parser.read_events(), stack):
+        yield element
+
+
+def _yield_and_remove(events, stack):
+    """Yield the elements at their end events and remove them from the tree
+    after they have been handled.
+
+    :events: Iterable of (event, element) tuples of start and end events
+    :stack: List of the open elements, shared between successive calls
+    :yields: elements as lxml.ElementTree objects
+
+    """
+    for event, element in events:
 
         if event == 'start':
             stack.append(element)
@@ -171,3 +890,739 @@ def iter_elements(source):
 
         if stack:
             stack[-1].remove(element)
+
+
+def iter_records(source, tag=None, path=None, namespaces=None):
+    """Iterate over the elements in given XML file object as lightweight
+    records.
+
+    The tag, attributes, stripped text and depth of each element yielded
+    by iter_elements are copied to an ElementRecord before the element is
+    removed from the tree. Unlike lxml elements, the records do not keep
+    any part of the parsed document in memory, and the tags and attribute
+    names are interned, so that collecting a large number of records is
+    cheap.
+
+    :source: Filename or file-like object
+    :tag: Tag or list of tags of the elements to yield, see iter_elements
+    :path: Path of the elements to yield, see iter_elements
+    :namespaces: Dictionary of namespace prefixes used in tag and path
+    :yields: ElementRecord named tuples
+
+    """
+    for element in iter_elements(source, tag=tag, path=path,
+                                 namespaces=namespaces):
+        text = element.text
+        yield ElementRecord(
+            sys.intern(element.tag),
+            {sys.intern(key): value for key, value in element.attrib.items()},
+            text.strip() if text is not None else None,
+            sum(1 for _ in element.iterancestors()))
+
+
+def split_records(source, tag=None, path=None, namespaces=None):
+    """Split given XML file into shards at the record elements.
+
+    The records are selected like the elements in iter_elements, and each
+    record is serialized with its child tree and the namespace declarations
+    in scope, so that each shard is a well-formed XML document.
+
+    :source: Filename or file-like object
+    :tag: Tag or list of tags of the record elements
+    :path: Path of the record elements, see iter_elements
+    :namespaces: Dictionary of namespace prefixes used in tag and path
+    :yields: Records as UTF-8 encoded byte strings
+
+    """
+    for element in iter_elements(source, tag=tag, path=path,
+                                 namespaces=namespaces):
+        yield ET.tostring(element, encoding='UTF-8', with_tail=False)
+
+
+def map_records(source, func, tag=None, path=None, namespaces=None,
+                workers=1, chunksize=64):
+    """Apply a function to each record element in given XML file.
+
+    The file is split into records with split_records, and the records are
+    sent to a pool of worker processes in chunks, where they are parsed and
+    passed to the function. The number of chunks in processing at a time is
+    limited, so the memory usage does not depend on the size of the file.
+
+    :source: Filename or file-like object
+    :func: Picklable function, called with the root element of each record
+    :tag: Tag or list of tags of the record elements
+    :path: Path of the record elements, see iter_elements
+    :namespaces: Dictionary of namespace prefixes used in tag and path
+    :workers: Number of worker processes, with one worker the records are
+              processed in the current process
+    :chunksize: Number of records sent to a worker process at a time
+    :yields: Return values of the function in the order of the records
+
+    """
+    records = split_records(source, tag=tag, path=path,
+                            namespaces=namespaces)
+    chunks = iter(lambda: list(itertools.islice(records, chunksize)), [])
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _map_record_chunk(func, chunk)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(_map_record_chunk, func, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def map_files(paths, func, workers=1, chunksize=16, max_in_flight=None):
+    """Apply a function to each of given files in a pool of worker
+    processes.
+
+    The paths are sent to the worker processes in chunks, and the results
+    are yielded as soon as each chunk is completed, so they are not in the
+    order of the paths. The number of chunks in processing at a time is
+    limited, so the paths can be given as a generator of any length. An
+    exception raised by the function is captured in the result of the file
+    instead of stopping the processing of the other files.
+
+    With more than one worker, the return values of the function must be
+    picklable, e.g. counts or serialized XML rather than lxml trees. An
+    unpicklable return value is reported as the error of its file. If a
+    worker process crashes, the error is reported for each file of the
+    chunks in processing, and the rest of the files are processed in a new
+    pool of worker processes.
+
+    :paths: Iterable of file paths
+    :func: Picklable function called with each path, such as a function
+           calling readfile or iter_elements
+    :workers: Number of worker processes, with one worker the files are
+              processed in the current process
+    :chunksize: Number of paths sent to a worker process at a time
+    :max_in_flight: Maximum number of chunks in processing at a time,
+                    defaults to twice the number of workers
+    :yields: FileResult named tuples with the path, and either the return
+             value of the function or the error message
+
+    """
+    paths = iter(paths)
+    chunks = iter(lambda: list(itertools.islice(paths, chunksize)), [])
+
+    if workers <= 1:
+        for chunk in chunks:
+            yield from _map_file_chunk(func, chunk)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = {}
+    try:
+        for chunk in chunks:
+            try:
+                future = executor.submit(_map_file_chunk, func, chunk, True)
+            except BrokenProcessPool:
+                # A worker process has crashed, so the chunks in the pool
+                # have failed, and the rest are processed in a new pool
+                executor.shutdown(wait=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+                future = executor.submit(_map_file_chunk, func, chunk, True)
+            pending[future] = chunk
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from _chunk_results(future, pending.pop(future))
+        for future in as_completed(pending):
+            yield from _chunk_results(future, pending[future])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _chunk_results(future, paths):
+    """Return the results of a completed chunk of map_files, or the error
+    of the chunk as the result of each of its files.
+
+    :future: Completed future of _map_file_chunk
+    :paths: List of the file paths of the chunk
+    :returns: List of FileResult named tuples
+    """
+    try:
+        return future.result()
+    except Exception as exception:  # pylint: disable=broad-except
+        error = f'{type(exception).__name__}: {exception}'
+        return [FileResult(path, None, error) for path in paths]
+
+
+def _map_file_chunk(func, paths, check_pickle=False):
+    """Apply the function to each of the files, capturing the errors.
+
+    :func: Function to apply
+    :paths: List of file paths
+    :check_pickle: Whether to check that the results can be pickled, so
+                   that an unpicklable result is reported as the error of
+                   its file instead of failing the whole chunk
+    :returns: List of FileResult named tuples
+    """
+    results = []
+    for path in paths:
+        try:
+            result = func(path)
+            if check_pickle:
+                pickle.dumps(result)
+            results.append(FileResult(path, result, None))
+        except Exception as exception:  # pylint: disable=broad-except
+            results.append(FileResult(
+                path, None, f'{type(exception).__name__}: {exception}'))
+    return results
+
+
+def _map_record_chunk(func, records):
+    """Parse the serialized records and apply the function to them.
+
+    :func: Function to apply
+    :records: List of serialized records
+    :returns: List of the return values of the function
+    """
+    return [func(ET.fromstring(record)) for record in records]
+
+
+def _iter_matching_elements(source, tag, path, namespaces):
+    """Iterate over the elements matching the given tag or path, see
+    iter_elements.
+    """
+    tags, steps, absolute = _parse_filter(tag, path, namespaces)
+
+    # Only the end events of the elements with matching tags are reported
+    # by iterparse, so the content between them is removed when the next
+    # one ends. Elements inside an element with a matching tag are kept
+    # until it ends.
+    for _, element in ET.iterparse(source, tag=list(tags)):
+        # The outermost open element with a matching tag, or the element
+        # itself
+        top = element
+        for top in element.iterancestors(*tags):
+            pass
+        _remove_preceding_siblings(top)
+
+        matches = steps is None or _path_matches(element, steps, absolute)
+        if matches:
+            yield element
+
+        parent = element.getparent()
+        if parent is not None and (matches or top is element):
+            parent.remove(element)
+
+
+def _remove_preceding_siblings(element):
+    """Remove the already parsed preceding siblings of the element and of
+    each of its ancestors from the tree.
+
+    :element: Element
+    """
+    parent = element.getparent()
+    while parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+        element = parent
+        parent = element.getparent()
+
+
+def _parse_filter(tag, path, namespaces):
+    """Parse the tag or path filter of iter_elements or readfile_partial.
+
+    :tag: Tag or list of tags
+    :path: Path of the elements
+    :namespaces: Dictionary of namespace prefixes used in tag and path
+    :returns: Tuple of the set of matching tags, the tags of the path steps
+              or None, and whether the path is absolute
+    """
+    if tag is not None and path is not None:
+        raise ValueError("Only one of tag and path can be given")
+
+    steps = None
+    absolute = False
+    if path is not None:
+        absolute = path.startswith('/')
+        steps = [_resolve_tag(step, namespaces)
+                 for step in path.strip('/').split('/')]
+        tags = {steps[-1]}
+    elif isinstance(tag, str):
+        tags = {_resolve_tag(tag, namespaces)}
+    else:
+        tags = {_resolve_tag(item, namespaces) for item in tag}
+    return tags, steps, absolute
+
+
+def _resolve_tag(tag, namespaces):
+    """Convert a prefixed tag to Clark notation.
+
+    :tag: Tag as prefix:name, {namespace}name or name
+    :namespaces: Dictionary of namespace prefixes
+    :returns: Tag in Clark notation
+
+    """
+    if tag.startswith('{') or ':' not in tag:
+        return tag
+    prefix, name = tag.split(':', 1)
+    try:
+        return f'{{{namespaces[prefix]}}}{name}'
+    except (KeyError, TypeError) as exception:
+        raise ValueError(f"Unknown namespace prefix: {prefix}") from exception
+
+
+def _path_matches(element, steps, absolute):
+    """Check that the ancestors of the element match the path.
+
+    :element: Element with a tag matching the last step of the path
+    :steps: Tags of the path in Clark notation
+    :absolute: True if the path starts from the root element
+    :returns: True if the path matches, otherwise False
+
+    """
+    ancestor = element.getparent()
+    for step in reversed(steps[:-1]):
+        if ancestor is None or ancestor.tag != step:
+            return False
+        ancestor = ancestor.getparent()
+    return not absolute or ancestor is None
+
+
+class CheckpointedIterator:
+    """Resumable iterator over all elements in given XML file.
+
+    The elements are yielded like in iter_elements. After the consumer has
+    handled a top-level record, i.e. a child element of the root element,
+    the ``checkpoint`` attribute is updated to record the byte offset
+    following the record and its tail, and the start tags and texts of its
+    open ancestors. A new iterator created with a saved checkpoint seeks to
+    the offset and re-creates the ancestors from the start tags, so that it
+    continues with the elements following the record.
+
+    Usage::
+
+        iterator = CheckpointedIterator(filename, checkpoint=saved)
+        for element in iterator:
+            handle(element)
+            saved = iterator.checkpoint
+
+    NOTE: Declarations in the internal DTD subset of the document, such as
+    entity declarations, are not available to the resumed iterator.
+    """
+
+    def __init__(self, source, checkpoint=None):
+        """Initialize the iterator.
+
+        :source: Filename or seekable binary file-like object
+        :checkpoint: Checkpoint to resume from, or None to start from the
+                     beginning of the file
+        """
+        self.source = source
+        self.checkpoint = checkpoint
+
+    def __iter__(self):
+        if isinstance(self.source, str):
+            with open(self.source, 'rb') as source:
+                yield from self._iter_elements(source)
+        else:
+            yield from self._iter_elements(self.source)
+
+    def _iter_elements(self, source):
+        """Iterate over the elements of an opened file, starting from the
+        checkpoint.
+        """
+        if self.checkpoint is None:
+            offset = source.tell()
+            head = source.read(_TagReader.CHUNK_SIZE)
+            encoding = _declared_encoding(head)
+            reader = _TagReader(source, head, offset)
+        else:
+            encoding = self.checkpoint.encoding
+            prefix = (
+                f'<?xml version="1.0" encoding="{encoding}"?>'
+                + ''.join(self.checkpoint.ancestors)
+            ).encode(encoding)
+            source.seek(self.checkpoint.offset)
+            reader = _TagReader(source, prefix,
+                                self.checkpoint.offset - len(prefix))
+
+        ancestors = None
+        ended = None
+        for event, element in ET.iterparse(reader, events=('start', 'end')):
+            # The element ended at the previous end event is yielded and
+            # removed only now, when its tail has been parsed, so that the
+            # tail is removed with it instead of being appended to the
+            # parent. The checkpoint following a top-level record is set
+            # before the record is yielded, so that it is available to the
+            # consumer as soon as it has handled the record.
+            if ended is not None:
+                parent = ended.getparent()
+                if parent.getparent() is None:
+                    if ancestors is None:
+                        ancestors = (_start_tag(parent) +
+                                     escape(parent.text or ''),)
+                    self.checkpoint = Checkpoint(reader.tag_offset,
+                                                 ancestors, encoding)
+                yield ended
+                parent.remove(ended)
+                ended = None
+
+            if event == 'end':
+                if element.getparent() is None:
+                    yield element
+                else:
+                    ended = element
+
+
+def build_index(source, index_path=None, tag=None, id_attributes=('ID',),
+                namespaces=None):
+    """Write a sidecar index of the byte ranges of the elements in given
+    XML file.
+
+    The file is streamed once, and the byte ranges of the elements are
+    indexed by their tags in document order, and by the values of the
+    first of the given ID attributes they have. By default, only the
+    elements with an ID attribute are indexed, and all elements only if
+    the tag is '*'.
+
+    The index file used by XMLIndex starts with a line of JSON metadata,
+    followed by the starts, lengths and namespace contexts of the elements
+    as arrays of the smallest sufficient integer types, sorted by tag and
+    position, the positions of the elements sorted by ID, and the
+    NUL-separated UTF-8 encoded IDs. The arrays are loaded as such, without
+    parsing each element entry separately.
+
+    :source: Path to the XML file
+    :index_path: Path to the index file, defaults to the path of the XML
+                 file with the suffix .index
+    :tag: Tag or list of tags of the elements to index, or '*' for all
+          elements
+    :id_attributes: Names of the ID attributes to index the elements by
+    :namespaces: Dictionary of namespace prefixes used in the tags
+    :returns: Path to the index file
+
+    """
+    if index_path is None:
+        index_path = source + INDEX_SUFFIX
+    if isinstance(tag, str):
+        tag = [tag]
+    tags = tag and {_resolve_tag(item, namespaces) for item in tag}
+    index_all = tags is not None and '*' in tags
+
+    contexts = {}
+    entries = []
+    # The stack contains the open elements as [element, start offset,
+    # index of the namespace context of its children] lists, so that the
+    # context is serialized only once for the children of each element
+    stack = []
+    with open(source, 'rb') as source_file:
+        stat = os.fstat(source_file.fileno())
+        head = source_file.read(_TagReader.CHUNK_SIZE)
+        encoding = _declared_encoding(head)
+        reader = _TagReader(source_file, head)
+
+        for event, element in ET.iterparse(reader, events=['start', 'end']):
+            if event == 'start':
+                stack.append([element, reader.tag_offset, None])
+                continue
+
+            _, start, _ = stack.pop()
+            id_value = None
+            for attribute in id_attributes:
+                id_value = element.get(attribute)
+                if id_value is not None:
+                    break
+
+            if index_all or (element.tag in tags if tags is not None
+                             else id_value is not None):
+                entries.append((element.tag, start, reader.offset - start,
+                                _child_context(stack, contexts), id_value))
+
+            if stack:
+                stack[-1][0].remove(element)
+
+    # The entries of each tag are stored contiguously in document order,
+    # and the IDs are sorted as UTF-8 byte strings, which sorts them in the
+    # same order as the code points
+    entries.sort()
+    tag_counts = {}
+    for entry in entries:
+        tag_counts[entry[0]] = tag_counts.get(entry[0], 0) + 1
+    ids = sorted((entry[4].encode('utf-8'), position)
+                 for position, entry in enumerate(entries)
+                 if entry[4] is not None)
+    arrays = [_compact_array([entry[column] for entry in entries])
+              for column in (1, 2, 3)]
+    arrays.append(_compact_array([position for _, position in ids]))
+    id_keys = b'\0'.join(key for key, _ in ids)
+
+    header = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'encoding': encoding,
+        'byteorder': sys.byteorder,
+        'contexts': list(contexts),
+        'tags': list(tag_counts.items()),
+        'typecodes': [column.typecode for column in arrays],
+        'ids': len(ids),
+        'id_keys_size': len(id_keys)
+    }
+    with open(index_path, 'wb') as index_file:
+        index_file.write(json.dumps(header, separators=(',', ':')).encode(
+            'utf-8') + b'\n')
+        for column in arrays:
+            column.tofile(index_file)
+        index_file.write(id_keys)
+    return index_path
+
+
+def _child_context(stack, contexts):
+    """Return the index of the namespace context of the children of the
+    innermost open element, serializing it at the first call only.
+
+    :stack: Stack of the open elements of build_index
+    :contexts: Dictionary of the serialized contexts and their indexes
+    :returns: Index of the context
+    """
+    if not stack:
+        return contexts.setdefault('', len(contexts))
+    entry = stack[-1]
+    if entry[2] is None:
+        entry[2] = contexts.setdefault(
+            _namespace_declarations(entry[0].nsmap), len(contexts))
+    return entry[2]
+
+
+def _compact_array(values):
+    """Return non-negative integers as an array of the smallest unsigned
+    integer type they fit in.
+
+    :values: List of integers
+    :returns: array of the integers
+    """
+    maximum = max(values, default=0)
+    for typecode in 'BHI':
+        if maximum >> 8 * array(typecode).itemsize == 0:
+            return array(typecode, values)
+    return array('Q', values)
+
+
+class XMLIndex:
+    """Random access to the elements of an XML file indexed with
+    build_index.
+
+    The XML file is memory-mapped, and only the byte range of the requested
+    element is parsed. The elements are looked up by ID with a binary
+    search, and by tag and ordinal directly.
+
+    Usage::
+
+        with XMLIndex(filename) as index:
+            element = index.find_by_id('file-001')
+
+    NOTE: Entities declared in the internal DTD subset of the document are
+    not available when parsing the elements.
+    """
+
+    def __init__(self, source, index_path=None):
+        """Open the XML file and load its index.
+
+        :source: Path to the XML file
+        :index_path: Path to the index file, defaults to the path of the
+                     XML file with the suffix .index
+        :raises: ValueError if the XML file has changed after indexing
+        """
+        if index_path is None:
+            index_path = source + INDEX_SUFFIX
+        with open(index_path, 'rb') as index_file:
+            header = json.loads(index_file.readline())
+            if header.get('version') != INDEX_VERSION:
+                raise ValueError(f"Index {index_path} is out of date")
+            data = index_file.read()
+
+        stat = os.stat(source)
+        if (header['size'], header['mtime_ns']) != (stat.st_size,
+                                                    stat.st_mtime_ns):
+            raise ValueError(f"Index {index_path} is out of date")
+
+        swap = header['byteorder'] != sys.byteorder
+        position = 0
+        columns = []
+        lengths = [sum(count for _, count in header['tags'])] * 3 + [
+            header['ids']]
+        for typecode, length in zip(header['typecodes'], lengths):
+            column = array(typecode)
+            size = length * column.itemsize
+            column.frombytes(data[position:position + size])
+            if swap:
+                column.byteswap()
+            columns.append(column)
+            position += size
+
+        self._encoding = header['encoding']
+        self._contexts = header['contexts']
+        self._starts, self._lengths, self._context_indexes, self._ids = \
+            columns
+        # First position and number of the entries of each tag
+        self._tags = {}
+        first = 0
+        for name, count in header['tags']:
+            self._tags[name] = (first, count)
+            first += count
+        id_keys = data[position:position + header['id_keys_size']]
+        self._id_keys = id_keys.split(b'\0') if header['ids'] else []
+
+        with open(source, 'rb') as source_file:
+            self._map = mmap.mmap(source_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the memory map of the XML file."""
+        self._map.close()
+
+    def find_by_id(self, value):
+        """Return the element with the given ID.
+
+        :value: Value of the ID attribute
+        :returns: Element, or None if there is no element with the ID
+        """
+        key = value.encode('utf-8')
+        position = bisect.bisect_left(self._id_keys, key)
+        if position == len(self._id_keys) or \
+                self._id_keys[position] != key:
+            return None
+        return self._parse(self._ids[position])
+
+    def find_by_tag(self, tag, ordinal=0, namespaces=None):
+        """Return the element with the given tag and ordinal.
+
+        :tag: Tag of the element
+        :ordinal: Position of the element among the elements with the same
+                  tag in document order, starting from 0
+        :namespaces: Dictionary of namespace prefixes used in the tag
+        :returns: Element, or None if there are not as many elements with
+                  the tag
+        """
+        first, count = self._tags.get(_resolve_tag(tag, namespaces), (0, 0))
+        if not 0 <= ordinal < count:
+            return None
+        return self._parse(first + ordinal)
+
+    def count(self, tag, namespaces=None):
+        """Return the number of indexed elements with the given tag.
+
+        :tag: Tag of the elements
+        :namespaces: Dictionary of namespace prefixes used in the tag
+        :returns: Number of elements
+        """
+        return self._tags.get(_resolve_tag(tag, namespaces), (0, 0))[1]
+
+    def _parse(self, position):
+        """Parse the element of the entry at the given position within the
+        namespace declarations of its ancestors.
+        """
+        start = self._starts[position]
+        end = start + self._lengths[position]
+        context = self._contexts[self._context_indexes[position]]
+        prefix = (f'<?xml version="1.0" encoding="{self._encoding}"?>'
+                  f'<context{context}>')
+        data = (prefix.encode(self._encoding) + self._map[start:end]
+                + '</context>'.encode(self._encoding))
+        return ET.fromstring(data)[0]
+
+
+class _TagReader:
+    """File-like reader returning the data one tag at a time.
+
+    Each read ends at the next '>' character, so that the parser consuming
+    the data has parsed each tag right after reading its end, and
+    ``offset`` is the position in the file right after the tag. The
+    position of the '<' character starting the tag is ``tag_offset``.
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, source, prefix=b'', offset=0):
+        """Initialize the reader.
+
+        :source: Binary file-like object
+        :prefix: Data to read before the data from the source
+        :offset: Position of the start of the prefix in the file
+        """
+        self.offset = offset
+        self.tag_offset = None
+        self._source = source
+        self._buffer = prefix
+        self._position = 0
+
+    def read(self, size=-1):  # pylint: disable=unused-argument
+        """Read the data up to and including the next '>' character.
+
+        :size: Ignored, the returned data can be of any size
+        :returns: Data as byte string, empty at the end of the file
+        """
+        if self._position >= len(self._buffer):
+            self._buffer = self._source.read(self.CHUNK_SIZE)
+            self._position = 0
+
+        end = self._buffer.find(b'>', self._position) + 1
+        if end == 0:
+            end = len(self._buffer)
+
+        data = self._buffer[self._position:end]
+        self._position = end
+        tag_start = data.rfind(b'<')
+        if tag_start != -1:
+            self.tag_offset = self.offset + tag_start
+        self.offset += len(data)
+        return data
+
+
+def _start_tag(element):
+    """Serialize the start tag of an element, including its namespace
+    declarations.
+
+    :element: Element
+    :returns: Start tag as string
+    """
+    shallow_copy = ET.Element(element.tag, element.attrib,
+                              nsmap=element.nsmap)
+    return ET.tostring(shallow_copy, encoding='unicode')[:-2] + '>'
+
+
+def _declared_encoding(head):
+    """Return the encoding declared in the XML declaration.
+
+    :head: Beginning of the XML file as byte string
+    :returns: Declared encoding, or UTF-8 if no encoding is declared
+    """
+    match = XML_DECLARATION_ENCODING.match(head)
+    if match is None:
+        return 'UTF-8'
+    return match.group(1).decode('ascii')
+
+
+def _namespace_declarations(nsmap):
+    """Serialize namespace declarations.
+
+    :nsmap: Dictionary of namespace prefixes and URIs
+    :returns: Namespace declarations as a string starting with a space
+    """
+    declarations = []
+    for prefix, uri in sorted(nsmap.items(), key=lambda item: item[0] or ''):
+        name = f'xmlns:{prefix}' if prefix else 'xmlns'
+        declarations.append(f' {name}={quoteattr(uri)}')
+    return ''.join(declarations)
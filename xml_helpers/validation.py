@@ -0,0 +1,147 @@
+"""A module for validating XML files against XML schemas."""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import lxml.etree as ET
+
+from xml_helpers.cache import LRUCache
+from xml_helpers.schema_catalog import CatalogSchemaResolver
+from xml_helpers.utils import readfile
+
+# Process-wide cache of compiled schemas. The maximum number of cached
+# schemas can be changed by setting SCHEMA_CACHE.maxsize.
+SCHEMA_CACHE = LRUCache(maxsize=32)
+
+
+def get_schema(schema_path, catalog_path=None):
+    """Return a compiled XML schema, using SCHEMA_CACHE.
+
+    The schemas are cached by the resolved paths of the schema and the
+    catalog, and the modification time and size of the schema file. Changes
+    to the imported schemas or to the catalog are not detected, so the
+    cache has to be cleared with SCHEMA_CACHE.clear() after changing them.
+
+    :param schema_path: Path to the XML schema file
+    :param catalog_path: Path to the catalog file used for resolving the
+        schemas imported by the schema, see CatalogSchemaResolver
+    :returns: lxml.etree.XMLSchema object
+    """
+    stat = os.stat(schema_path)
+    key = (os.path.realpath(schema_path), stat.st_mtime_ns, stat.st_size,
+           catalog_path and os.path.realpath(catalog_path))
+    schema = SCHEMA_CACHE.get(key)
+    if schema is None:
+        parser = ET.XMLParser()
+        if catalog_path is not None:
+            parser.resolvers.add(CatalogSchemaResolver.from_catalog(
+                os.path.dirname(catalog_path),
+                os.path.basename(catalog_path)))
+        schema = ET.XMLSchema(ET.parse(schema_path, parser=parser))
+        SCHEMA_CACHE.put(key, schema)
+    return schema
+
+
+def validate(path, schema_path, catalog_path=None):
+    """Validate an XML file against an XML schema.
+
+    The file is read with readfile, and the schema is compiled with
+    get_schema. Errors in reading the file are reported like validation
+    errors.
+
+    :param path: Path to the XML file
+    :param schema_path: Path to the XML schema file
+    :param catalog_path: Path to the catalog file used for resolving the
+        schemas imported by the schema
+    :returns: Validation result as a dict::
+
+        {
+            'filename': path,
+            'valid': False,
+            'errors': [
+                {'line': 1, 'column': 0, 'level': 'ERROR',
+                 'message': 'Element 'foo': ...'}
+            ]
+        }
+
+    """
+    schema = get_schema(schema_path, catalog_path)
+    try:
+        valid = schema.validate(readfile(path))
+        error_log = schema.error_log
+    except ET.XMLSyntaxError as exception:
+        valid = False
+        error_log = exception.error_log
+    except OSError as exception:
+        return {
+            'filename': path,
+            'valid': False,
+            'errors': [{'line': None, 'column': None, 'level': 'FATAL',
+                        'message': str(exception)}]
+        }
+
+    return {
+        'filename': path,
+        'valid': valid,
+        'errors': [
+            {'line': error.line, 'column': error.column,
+             'level': error.level_name, 'message': error.message}
+            for error in error_log]
+    }
+
+
+def validate_many(paths, schema_path, catalog_path=None, workers=1,
+                  chunksize=16, max_in_flight=None):
+    """Validate XML files against an XML schema.
+
+    With more than one worker, the files are validated in a pool of worker
+    processes. Each worker process compiles the schema only once. The
+    number of chunks in processing at a time is limited, so the paths can
+    be given as a generator of any length, and the results are yielded in
+    the order of the paths as soon as they are available.
+
+    :param paths: Iterable of paths to the XML files
+    :param schema_path: Path to the XML schema file
+    :param catalog_path: Path to the catalog file used for resolving the
+        schemas imported by the schema
+    :param workers: Number of worker processes
+    :param chunksize: Number of files sent to a worker process at a time
+    :param max_in_flight: Maximum number of chunks in processing at a time,
+        defaults to twice the number of workers
+    :yields: Validation results in the order of the paths, see validate
+    """
+    if workers <= 1:
+        for path in paths:
+            yield validate(path, schema_path, catalog_path)
+        return
+
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+
+    paths = iter(paths)
+    chunks = iter(lambda: list(islice(paths, chunksize)), [])
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(executor.submit(_validate_chunk, chunk,
+                                           schema_path, catalog_path))
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _validate_chunk(paths, schema_path, catalog_path):
+    """Validate a chunk of XML files in a worker process of validate_many.
+
+    :param paths: List of paths to the XML files
+    :param schema_path: Path to the XML schema file
+    :param catalog_path: Path to the catalog file
+    :returns: List of validation results, see validate
+    """
+    return [validate(path, schema_path, catalog_path) for path in paths]